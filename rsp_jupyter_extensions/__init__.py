@@ -4,9 +4,14 @@ from .handlers.abnormal import AbnormalStartupHandler
 from .handlers.config import ConfigHandler
 from .handlers.execution import ExecutionHandler
 from .handlers.ghostwriter import GhostwriterHandler
+from .handlers.httpclients import SETTINGS_KEY, HTTPClientManager
 from .handlers.hub import HubHandler
 from .handlers.pdfexport import PDFExportHandler
-from .handlers.query import QueryHandler
+from .handlers.query import (
+    QueryEventsHandler,
+    QueryHandler,
+    _close_query_state,
+)
 from .handlers.tutorials import TutorialsMenuHandler
 
 try:
@@ -41,6 +46,8 @@ def _setup_handlers(server_app) -> None:  # type: ignore
         r"/rubin/ghostwriter($|/$|/.*)": GhostwriterHandler,
         r"/rubin/hub": HubHandler,
         r"/rubin/pdfexport": PDFExportHandler,
+        # Must come before the catch-all queries route.
+        r"/rubin/queries/tap/events": QueryEventsHandler,
         r"/rubin/queries($|/$|.*)": QueryHandler,
         r"/rubin/tutorials": TutorialsMenuHandler,
     }
@@ -55,6 +62,23 @@ def _setup_handlers(server_app) -> None:  # type: ignore
     web_app.add_handlers(host_pattern, handlers)
 
 
+def _setup_http_clients(server_app) -> None:  # type: ignore
+    """Create the shared HTTP client pools and close them at shutdown."""
+    manager = HTTPClientManager(logger=server_app.log)
+    server_app.web_app.settings[SETTINGS_KEY] = manager
+    # Module-style server extensions get no shutdown hook of their own, so
+    # piggyback on the server's extension cleanup.
+    cleanup_extensions = server_app.cleanup_extensions
+
+    async def _cleanup_extensions() -> None:
+        # Background work must stop before the pools it uses are closed.
+        await _close_query_state(server_app.web_app.settings)
+        await manager.aclose()
+        await cleanup_extensions()
+
+    server_app.cleanup_extensions = _cleanup_extensions
+
+
 def _load_jupyter_server_extension(server_app) -> None:  # type: ignore
     """Registers the API handler to receive HTTP requests from the frontend extension.
 
@@ -64,6 +88,7 @@ def _load_jupyter_server_extension(server_app) -> None:  # type: ignore
         JupyterLab application instance
     """
     _setup_handlers(server_app)
+    _setup_http_clients(server_app)
     name = "rsp_jupyter_extensions"
     server_app.log.info(f"Registered {name} server extension")
 
@@ -0,0 +1,72 @@
+"""Debounced background work that outlives the request that asked for it."""
+
+import asyncio
+import logging
+from collections.abc import Awaitable, Callable
+from contextlib import suppress
+
+
+class Debouncer:
+    """Run a coroutine function in the background, coalescing triggers.
+
+    The first call to `schedule` starts a run after ``delay`` seconds.
+    Further calls before that run starts are absorbed into it; calls made
+    while it is running cause exactly one more run, ``delay`` seconds after
+    it finishes.  However often it is triggered, at most one run is ever in
+    progress.
+
+    Parameters
+    ----------
+    delay
+        How long to wait, in seconds, before each run.
+    logger
+        Logger to use (optional, created if not specified)
+    """
+
+    def __init__(
+        self, delay: float = 2.0, logger: logging.Logger | None = None
+    ) -> None:
+        self._delay = delay
+        self._logger = logger or logging.getLogger(__name__)
+        self._func: Callable[[], Awaitable[object]] | None = None
+        self._task: asyncio.Task[None] | None = None
+        self._pending = False
+
+    def schedule(self, func: Callable[[], Awaitable[object]]) -> None:
+        """Arrange for ``func`` to be run soon.
+
+        If several calls are coalesced, the most recent ``func`` is the one
+        that runs.
+        """
+        self._func = func
+        self._pending = True
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def wait(self) -> None:
+        """Wait until no run is scheduled or in progress."""
+        while self._task is not None and not self._task.done():
+            await self._task
+
+    async def aclose(self) -> None:
+        """Cancel any scheduled or running work and wait for it to stop."""
+        self._pending = False
+        self._func = None
+        task, self._task = self._task, None
+        if task is not None and not task.done():
+            task.cancel()
+            with suppress(asyncio.CancelledError):
+                await task
+
+    async def _run(self) -> None:
+        while self._pending:
+            await asyncio.sleep(self._delay)
+            self._pending = False
+            func = self._func
+            if func is None:
+                continue
+            try:
+                await func()
+            except Exception:
+                # Background work has nobody to report to but the log.
+                self._logger.exception("Background task failed")
@@ -0,0 +1,79 @@
+"""Retry delays and circuit breaking for calls to flaky services."""
+
+import random
+import time
+
+
+def backoff_delay(attempt: int, base: float, cap: float) -> float:
+    """Return how long to wait before retry number ``attempt`` (from 0).
+
+    This is exponential backoff with full jitter: a uniformly random delay
+    up to ``base * 2**attempt``, capped at ``cap``, so that clients that
+    failed together do not all retry together.
+    """
+    return random.uniform(0, min(cap, base * 2**attempt))  # noqa: S311
+
+
+class CircuitBreaker:
+    """Stop calling a service that keeps failing, for a while.
+
+    After ``threshold`` consecutive failures the circuit opens, and
+    `allow` says no for ``cooldown`` seconds.  After that, a single trial
+    call is allowed: if it succeeds the circuit closes again, and if it
+    fails the circuit stays open for another ``cooldown``.
+
+    Parameters
+    ----------
+    threshold
+        Consecutive failures that open the circuit.
+    cooldown
+        Seconds to wait before trying an open circuit again.
+    """
+
+    def __init__(self, threshold: int = 3, cooldown: float = 60.0) -> None:
+        self._threshold = max(1, threshold)
+        self._cooldown = cooldown
+        self._failures = 0
+        self._open_until: float | None = None
+        self._trial = False
+
+    @property
+    def is_open(self) -> bool:
+        """Whether calls are currently being refused."""
+        return self._open_until is not None and (
+            self._trial or time.monotonic() < self._open_until
+        )
+
+    def allow(self) -> bool:
+        """Whether a call may be made now.
+
+        When the cool-down has passed, this returns `True` once, for the
+        trial call, and `False` until that call's result is recorded.
+        """
+        if self._open_until is None:
+            return True
+        if self._trial or time.monotonic() < self._open_until:
+            return False
+        self._trial = True
+        return True
+
+    def record_success(self) -> None:
+        """Record a successful call, closing the circuit."""
+        self._failures = 0
+        self._open_until = None
+        self._trial = False
+
+    def release(self) -> None:
+        """End a call that was abandoned before it had a result.
+
+        Nothing is recorded, but if it was the trial call, another trial
+        is allowed.
+        """
+        self._trial = False
+
+    def record_failure(self) -> None:
+        """Record a failed call, opening the circuit if need be."""
+        self._failures += 1
+        if self._trial or self._failures >= self._threshold:
+            self._open_until = time.monotonic() + self._cooldown
+            self._trial = False
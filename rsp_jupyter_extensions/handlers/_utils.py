@@ -1,11 +1,14 @@
 """Utilities for working with Jupyter Server RSP handlers."""
 
+import asyncio
+import hashlib
 import json
 import os
-from contextlib import suppress
+import uuid
 from pathlib import Path
 from urllib.parse import urlsplit
 
+from ..models.query import NotebookBody
 from ..models.tutorials import UserEnvironmentError
 
 
@@ -13,19 +16,60 @@ class TokenNotAvailableError(RuntimeError):
     """No Gafaelfawr token is available."""
 
 
-def _get_access_token() -> str:
-    """Get our access token, preferred methods first."""
-    # We want this to be a constant static path, but...
-    path = Path("/etc/nublado/secrets/token")
-    if path.exists():
-        return path.read_text().strip()
-    # ... in April 2026 it is not yet, but NUBLADO_RUNTIME_MOUNTS_DIR should
-    # be set.
-    if runtime_dir := os.environ.get("NUBLADO_RUNTIME_MOUNTS_DIR"):
-        path = Path(runtime_dir) / "secrets" / "token"
-        with suppress(FileNotFoundError):
-            return path.read_text().strip()
-    raise TokenNotAvailableError("No access token available")
+class TokenProvider:
+    """Provide our access token, re-reading it only when it changes.
+
+    The token file is located the same way as before (preferred methods
+    first), and its contents are cached.  Each call checks the file's
+    modification time and re-reads it only if that has changed, so token
+    rotation is picked up without a file read on every request.
+    """
+
+    def __init__(self) -> None:
+        self._path: Path | None = None
+        self._mtime: int | None = None
+        self._token: str | None = None
+
+    @staticmethod
+    def _find_path() -> Path | None:
+        # We want this to be a constant static path, but...
+        path = Path("/etc/nublado/secrets/token")
+        if path.exists():
+            return path
+        # ... in April 2026 it is not yet, but NUBLADO_RUNTIME_MOUNTS_DIR
+        # should be set.
+        if runtime_dir := os.environ.get("NUBLADO_RUNTIME_MOUNTS_DIR"):
+            path = Path(runtime_dir) / "secrets" / "token"
+            if path.exists():
+                return path
+        return None
+
+    def get(self) -> str:
+        """Return the current token.
+
+        Raises
+        ------
+        TokenNotAvailableError
+            Raised if there is no token file.
+        """
+        path = self._path or self._find_path()
+        if path is None:
+            raise TokenNotAvailableError("No access token available")
+        try:
+            mtime = path.stat().st_mtime_ns
+            token = self._token
+            if token is None or path != self._path or mtime != self._mtime:
+                token = path.read_text().strip()
+                self._token, self._path, self._mtime = token, path, mtime
+        except FileNotFoundError as exc:
+            # Look for it again next time.
+            self._path = None
+            raise TokenNotAvailableError("No access token available") from exc
+        return token
+
+
+# Shared by everything that needs our token.
+_token_provider = TokenProvider()
 
 
 def _get_homedir() -> Path:
@@ -35,6 +79,13 @@ def _get_homedir() -> Path:
     return Path(homedir)
 
 
+def _get_cache_dir() -> Path:
+    # Honor XDG_CACHE_HOME if the user has set it; otherwise ~/.cache.
+    if cache_home := os.getenv("XDG_CACHE_HOME"):
+        return Path(cache_home) / "rsp_jupyter_extensions"
+    return _get_homedir() / ".cache" / "rsp_jupyter_extensions"
+
+
 def _get_jupyter_server_root() -> Path:
     # We can't use JUPYTER_SERVER_ROOT, as it's set by the JupyterLab process
     # for the subprocesses it spawns, but not in the parent process.
@@ -75,23 +126,75 @@ def _peel_route(path: str, stem: str) -> str | None:
     return shorty
 
 
-def _write_notebook_response(nb_text: str, target: Path) -> str:
+def _read_text_or_none(path: Path) -> str | None:
+    """Return the contents of ``path``, or `None` if it is not a file.
+
+    This blocks on disk I/O; async callers should run it in a thread.
+    """
+    try:
+        return path.read_text()
+    except (FileNotFoundError, IsADirectoryError):
+        return None
+
+
+def _write_if_changed(
+    text: str, target: Path, existing: str | None = None
+) -> bool:
+    """Atomically replace ``target`` with ``text``, unless it already holds
+    exactly that, and return whether it was written.
+
+    The text is written to a hidden temporary file in the same directory
+    and renamed over the target, so no reader ever sees a partial file.
+    ``existing``, if given, is taken to be the current contents of
+    ``target``, saving a read.
+
+    This blocks on disk I/O; async callers should run it in a thread.
+    """
+    if existing is None:
+        existing = _read_text_or_none(target)
+    if existing == text:
+        return False
+    target.parent.mkdir(parents=True, exist_ok=True)
+    tmp = target.with_name(f".{target.name}.{uuid.uuid4().hex}.tmp")
+    try:
+        tmp.write_text(text)
+        tmp.replace(target)
+    except BaseException:
+        tmp.unlink(missing_ok=True)
+        raise
+    return True
+
+
+async def _write_notebook_response(
+    nb_text: str,
+    target: Path,
+    existing: str | None = None,
+    *,
+    body: NotebookBody = NotebookBody.FULL,
+) -> str:
     """Given notebook text and a filename where it should go, return
     a response for Jupyter to give back to the extension to open that file
     in the JupyterLab UI.
+
+    The file is written in a worker thread, and only if its contents
+    (``existing``, if the caller has just read them) differ.  ``body``
+    says whether the response carries the notebook text, only its SHA-256
+    hash (as ``sha256``), or neither.
     """
-    dirname = target.parent
     fname = target.name
     # JUPYTER_SERVER_ROOT is set *by* JupyterLab, not in its environment.
     rname = target.relative_to(_get_jupyter_server_root())
-    dirname.mkdir(parents=True, exist_ok=True)
-    target.write_text(nb_text)
+    await asyncio.to_thread(_write_if_changed, nb_text, target, existing)
     top = os.environ.get("JUPYTERHUB_SERVICE_PREFIX", "")
     retval = {
         "status": 200,
         "filename": str(fname),
         "path": str(rname),
         "url": f"{top}/tree/{rname!s}",
-        "body": nb_text,
     }
+    match body:
+        case NotebookBody.FULL:
+            retval["body"] = nb_text
+        case NotebookBody.HASH:
+            retval["sha256"] = hashlib.sha256(nb_text.encode()).hexdigest()
     return json.dumps(retval)
@@ -0,0 +1,122 @@
+"""Incremental parsing of UWS documents returned by TAP services."""
+
+import heapq
+from contextlib import suppress
+from typing import Any
+from xml.etree.ElementTree import Element, XMLPullParser
+
+XLINK_NS = "http://www.w3.org/1999/xlink"
+EPOCH = "1970-01-01T00:00:00.000Z"
+# Phases a job never leaves.
+TERMINAL_PHASES = frozenset({"COMPLETED", "ERROR", "ABORTED", "ARCHIVED"})
+
+
+def _local_name(tag: str) -> str:
+    # ElementTree reports namespaced tags as "{uri}name".
+    return tag.rsplit("}", 1)[-1]
+
+
+def _jobref_to_dict(elem: Element) -> dict[str, str]:
+    """Convert a uws:jobref element to the mapping xmltodict would have
+    produced for it, which is what the rest of the extension expects.
+    """
+    retval: dict[str, str] = {}
+    for key, value in elem.attrib.items():
+        if key == "id":
+            retval["@id"] = value
+        elif key == f"{{{XLINK_NS}}}href":
+            retval["@xlink:href"] = value
+    for child in elem:
+        retval[f"uws:{_local_name(child.tag)}"] = (child.text or "").strip()
+    return retval
+
+
+def merge_jobrefs(
+    new: list[dict[str, str]], old: list[dict[str, str]], limit: int = 0
+) -> list[dict[str, str]]:
+    """Merge two newest-first jobref lists, preferring entries in ``new``.
+
+    Returns at most ``limit`` jobrefs (all of them if ``limit`` is zero or
+    negative), newest first.
+    """
+    seen = {job.get("@id") for job in new}
+    merged = new + [job for job in old if job.get("@id") not in seen]
+    merged.sort(key=lambda j: j.get("uws:creationTime", EPOCH), reverse=True)
+    return merged[:limit] if limit > 0 else merged
+
+
+class JobListParser:
+    """Incrementally parse a UWS job list, keeping only the newest jobrefs.
+
+    Feed it the response body a chunk at a time.  Each ``uws:jobref`` is
+    converted and discarded from the element tree as soon as it has been
+    read, and only the ``limit`` newest (by ``uws:creationTime``) are kept,
+    in a bounded heap, so memory use does not depend on the length of the
+    job list.
+
+    Parameters
+    ----------
+    limit
+        How many jobrefs to keep.  Zero or negative keeps all of them.
+    """
+
+    def __init__(self, limit: int = 0) -> None:
+        self._limit = limit
+        self._parser: XMLPullParser[Element] = XMLPullParser(
+            events=("start", "end")
+        )
+        self._root: Element | None = None
+        # Heap of (creation time, -sequence, jobref).  The negated sequence
+        # number means that among jobs with the same creation time, the
+        # ones that came first in the document are kept and listed first,
+        # as a stable sort of the whole list would have done.
+        self._heap: list[tuple[str, int, dict[str, Any]]] = []
+        self._seq = 0
+
+    def feed(self, data: bytes) -> None:
+        """Parse another chunk of the job list."""
+        self._parser.feed(data)
+        self._drain()
+
+    def close(self) -> list[dict[str, str]]:
+        """Finish parsing and return the kept jobrefs, newest first.
+
+        Raises
+        ------
+        xml.etree.ElementTree.ParseError
+            Raised if the document was not well-formed.
+        """
+        self._parser.close()
+        self._drain()
+        return self.jobrefs()
+
+    def jobrefs(self) -> list[dict[str, str]]:
+        """Return the jobrefs kept so far, newest first."""
+        return [entry[2] for entry in sorted(self._heap, reverse=True)]
+
+    def _drain(self) -> None:
+        for event, *rest in self._parser.read_events():
+            # We only ask for start and end events, which carry an element.
+            elem = rest[0] if rest else None
+            if not isinstance(elem, Element):
+                continue
+            if event == "start":
+                if self._root is None:
+                    self._root = elem
+                continue
+            if _local_name(elem.tag) != "jobref":
+                continue
+            self._push(_jobref_to_dict(elem))
+            # Drop the element so the tree does not grow with the list.
+            elem.clear()
+            if self._root is not None:
+                with suppress(ValueError):
+                    self._root.remove(elem)
+
+    def _push(self, job: dict[str, str]) -> None:
+        entry = (job.get("uws:creationTime", EPOCH), -self._seq, job)
+        self._seq += 1
+        if self._limit <= 0 or len(self._heap) < self._limit:
+            heapq.heappush(self._heap, entry)
+        else:
+            heapq.heappushpop(self._heap, entry)
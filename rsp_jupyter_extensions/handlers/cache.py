@@ -0,0 +1,266 @@
+"""Caches used by the query extension."""
+
+import logging
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from collections.abc import Mapping
+from pathlib import Path
+
+from ..models.query import CacheStats
+
+
+class LRUCache:
+    """Bounded in-memory string-to-string cache with usage counters.
+
+    The cache holds at most ``max_entries`` entries and ``max_size`` bytes
+    (counting the UTF-8 encoded key and value of each entry); the least
+    recently used entries are evicted to stay within both budgets.  A
+    single value larger than ``max_size`` is not cached at all.
+
+    Parameters
+    ----------
+    max_entries
+        Maximum number of entries to keep.
+    max_size
+        Maximum total size of the entries, in bytes.
+    """
+
+    def __init__(
+        self, max_entries: int = 1000, max_size: int = 8 * 1024 * 1024
+    ) -> None:
+        self._max_entries = max_entries
+        self._max_size = max_size
+        self._entries: OrderedDict[str, tuple[str, int]] = OrderedDict()
+        self._size = 0
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+
+    def get(self, key: str) -> str | None:
+        """Return the cached value for ``key``, or `None`."""
+        entry = self._entries.get(key)
+        if entry is None:
+            self._misses += 1
+            return None
+        self._hits += 1
+        self._entries.move_to_end(key)
+        return entry[0]
+
+    def put(self, key: str, value: str) -> None:
+        """Store ``value`` for ``key``, evicting old entries if needed."""
+        self.discard(key)
+        size = len(key.encode()) + len(value.encode())
+        if size > self._max_size or self._max_entries <= 0:
+            return
+        self._entries[key] = (value, size)
+        self._size += size
+        while (
+            len(self._entries) > self._max_entries
+            or self._size > self._max_size
+        ):
+            _, (_, evicted) = self._entries.popitem(last=False)
+            self._size -= evicted
+            self._evictions += 1
+
+    def discard(self, key: str) -> None:
+        """Remove ``key`` if it is present."""
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._size -= entry[1]
+
+    def __contains__(self, key: object) -> bool:
+        return key in self._entries
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def stats(self) -> CacheStats:
+        """Return the current counters."""
+        return CacheStats(
+            hits=self._hits,
+            misses=self._misses,
+            evictions=self._evictions,
+            entries=len(self._entries),
+            size=self._size,
+            max_entries=self._max_entries,
+            max_size=self._max_size,
+        )
+
+
+class ConditionalCache[T]:
+    """Remember response validators, and what we made of each response, so
+    that requests can be made conditional.
+
+    Entries are keyed by request URL.  A response with neither an ``ETag``
+    nor a ``Last-Modified`` header cannot be revalidated and is not stored.
+    The least recently used entries are evicted beyond ``max_entries``.
+
+    Parameters
+    ----------
+    max_entries
+        Maximum number of entries to keep.
+    """
+
+    def __init__(self, max_entries: int = 256) -> None:
+        self._max_entries = max_entries
+        self._entries: OrderedDict[str, tuple[dict[str, str], T]] = (
+            OrderedDict()
+        )
+
+    def headers(self, key: str) -> dict[str, str]:
+        """Return the headers that make a request for ``key`` conditional.
+
+        These are empty if nothing is stored for ``key``.
+        """
+        entry = self._entries.get(key)
+        return dict(entry[0]) if entry else {}
+
+    def get(self, key: str) -> T | None:
+        """Return the stored value for ``key``, after a 304 response."""
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        self._entries.move_to_end(key)
+        return entry[1]
+
+    def put(
+        self, key: str, response_headers: Mapping[str, str], value: T
+    ) -> None:
+        """Store ``value`` along with the validators from a response."""
+        validators: dict[str, str] = {}
+        if etag := response_headers.get("ETag"):
+            validators["If-None-Match"] = etag
+        if last_modified := response_headers.get("Last-Modified"):
+            validators["If-Modified-Since"] = last_modified
+        self._entries.pop(key, None)
+        if not validators:
+            return
+        self._entries[key] = (validators, value)
+        while len(self._entries) > self._max_entries:
+            self._entries.popitem(last=False)
+
+
+class PersistentCache:
+    """String-to-string cache kept in SQLite, so it survives lab restarts.
+
+    The number of entries is capped; when the cap is exceeded, the least
+    recently used entries are evicted.  Entries do not otherwise expire.
+
+    The database is opened on first use.  Any database error is logged and
+    disables the cache for the life of the process, since it is only ever
+    an optimization.
+
+    Methods block on disk I/O; async callers should run them in a thread.
+
+    Parameters
+    ----------
+    path
+        Location of the SQLite database file.
+    max_entries
+        Maximum number of entries to keep.
+    logger
+        Logger to use (optional, created if not specified)
+    """
+
+    def __init__(
+        self,
+        path: Path,
+        max_entries: int = 10000,
+        logger: logging.Logger | None = None,
+    ) -> None:
+        self._path = path
+        self._max_entries = max_entries
+        self._logger = logger or logging.getLogger(__name__)
+        self._lock = threading.Lock()
+        self._conn: sqlite3.Connection | None = None
+        self._disabled = False
+
+    def _connect(self) -> sqlite3.Connection | None:
+        if self._conn is None and not self._disabled:
+            try:
+                self._path.parent.mkdir(parents=True, exist_ok=True)
+                conn = sqlite3.connect(self._path, check_same_thread=False)
+                conn.execute(
+                    "CREATE TABLE IF NOT EXISTS cache ("
+                    " key TEXT PRIMARY KEY,"
+                    " value TEXT NOT NULL,"
+                    " last_used REAL NOT NULL)"
+                )
+                conn.execute(
+                    "CREATE INDEX IF NOT EXISTS cache_last_used"
+                    " ON cache (last_used)"
+                )
+                conn.commit()
+                self._conn = conn
+            except (OSError, sqlite3.Error) as exc:
+                self._fail(exc)
+        return self._conn
+
+    def _fail(self, exc: Exception) -> None:
+        self._logger.warning(f"Disabling cache {self._path}: {exc!s}")
+        self._disabled = True
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+    def get(self, key: str) -> str | None:
+        """Return the cached value for ``key``, or `None`."""
+        with self._lock:
+            if (conn := self._connect()) is None:
+                return None
+            try:
+                row = conn.execute(
+                    "SELECT value FROM cache WHERE key = ?", (key,)
+                ).fetchone()
+                if row is None:
+                    return None
+                conn.execute(
+                    "UPDATE cache SET last_used = ? WHERE key = ?",
+                    (time.time(), key),
+                )
+                conn.commit()
+            except sqlite3.Error as exc:
+                self._fail(exc)
+                return None
+            return row[0]
+
+    def put(self, key: str, value: str) -> None:
+        """Store ``value`` for ``key``, evicting old entries if needed."""
+        with self._lock:
+            if (conn := self._connect()) is None:
+                return
+            try:
+                conn.execute(
+                    "INSERT OR REPLACE INTO cache (key, value, last_used)"
+                    " VALUES (?, ?, ?)",
+                    (key, value, time.time()),
+                )
+                conn.execute(
+                    "DELETE FROM cache WHERE key IN ("
+                    " SELECT key FROM cache"
+                    " ORDER BY last_used DESC, rowid DESC"
+                    " LIMIT -1 OFFSET ?)",
+                    (self._max_entries,),
+                )
+                conn.commit()
+            except sqlite3.Error as exc:
+                self._fail(exc)
+
+    def __len__(self) -> int:
+        with self._lock:
+            if (conn := self._connect()) is None:
+                return 0
+            try:
+                return conn.execute("SELECT COUNT(*) FROM cache").fetchone()[0]
+            except sqlite3.Error as exc:
+                self._fail(exc)
+                return 0
+
+    def close(self) -> None:
+        """Close the database."""
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
@@ -3,15 +3,34 @@
 Used to encapsulate the queries we need to make to other RSP services.
 """
 
+import asyncio
 import logging
+import os
+import time
+from collections import OrderedDict
+from collections.abc import AsyncGenerator
 from dataclasses import dataclass
-
-import xmltodict
-from httpx import AsyncClient
+from pathlib import Path
+from typing import Any
+from xml.etree.ElementTree import ParseError
+
+from httpx import (
+    URL,
+    AsyncClient,
+    HTTPError,
+    TimeoutException,
+    TransportError,
+)
 from rubin.repertoire import DiscoveryClient
 
-from ..models.query import UnknownDatasetError
-from ._utils import _get_access_token
+from ..models.query import DatasetStatus, HistoryStatus, UnknownDatasetError
+from ..models.tutorials import UserEnvironmentError
+from ._retry import CircuitBreaker, backoff_delay
+from ._utils import _get_cache_dir
+from ._uws import EPOCH, TERMINAL_PHASES, JobListParser, merge_jobrefs
+from .cache import ConditionalCache
+from .discovery import DiscoveryCache
+from .httpclients import TokenAuth
 
 
 @dataclass
@@ -25,6 +44,82 @@ class JobRef:
     endpoint: str
 
 
+@dataclass
+class HistoryResult:
+    """Query history jobrefs for each dataset, newest first, and how the
+    request for each dataset went.
+    """
+
+    jobs: dict[str, list[dict[str, str]]]
+    status: dict[str, DatasetStatus]
+
+
+@dataclass
+class _EndpointHistory:
+    """The jobrefs we last saw from one TAP endpoint."""
+
+    limit: int
+    jobs: list[dict[str, str]]
+    full_at: float
+
+    def newest(self) -> str | None:
+        """Return the newest creation time, if the jobs can be refreshed
+        incrementally.
+
+        That is only so if none of them can still change phase, since a
+        request for newer jobs would not tell us about them.
+        """
+        if not self.jobs:
+            return None
+        if any(j.get("uws:phase") not in TERMINAL_PHASES for j in self.jobs):
+            return None
+        return self.jobs[0].get("uws:creationTime", EPOCH)
+
+
+# Responses that suggest trying again later might work.
+_RETRIABLE_STATUSES = {429, 500, 502, 503, 504}
+
+
+class _JobListError(Exception):
+    """A TAP endpoint did not give us its job list."""
+
+    def __init__(self, message: str, *, retriable: bool) -> None:
+        super().__init__(message)
+        self.retriable = retriable
+
+
+def _group_by_endpoint(endpoints: dict[str, str]) -> dict[str, list[str]]:
+    """Invert a dataset-to-endpoint map into endpoint-to-datasets."""
+    retval: dict[str, list[str]] = {}
+    for dataset, endpoint in endpoints.items():
+        retval.setdefault(endpoint, []).append(dataset)
+    return retval
+
+
+def _discovery_cache_file() -> Path | None:
+    """Where to persist discovery answers, if the user has a home."""
+    try:
+        return _get_cache_dir() / "discovery.json"
+    except UserEnvironmentError:
+        return None
+
+
+def _covers(have: int, want: int) -> bool:
+    """Whether a history fetched with limit ``have`` can answer a request
+    with limit ``want`` (a limit of zero or less means all jobs).
+    """
+    return have <= 0 or (want > 0 and have >= want)
+
+
+def _trim_history(history: HistoryResult, limit: int) -> HistoryResult:
+    """Copy a newest-first history, keeping ``limit`` jobs per dataset."""
+    if limit <= 0:
+        jobs = {ds: list(jobs) for ds, jobs in history.jobs.items()}
+    else:
+        jobs = {ds: jobs[:limit] for ds, jobs in history.jobs.items()}
+    return HistoryResult(jobs=jobs, status=dict(history.status))
+
+
 class RSPClient:
     """Convenience class to make accessing RSP services easy.
 
@@ -34,6 +129,9 @@ class RSPClient:
     we do need to send a token (such as TAP or Times Square).
 
     It also includes convenience methods for finding commonly-used endpoints.
+    Those are answered from a discovery snapshot that is refreshed in the
+    background and persisted to the user's cache directory, so that they
+    are available as soon as the lab starts.
 
     Parameters
     ----------
@@ -50,6 +148,49 @@ class RSPClient:
         $REPERTOIRE_URL if not specified)
     logger
         Logger to use (optional, created if not specified)
+    max_concurrency
+        Maximum number of TAP endpoints to query at once when gathering
+        query history (optional, taken from $TAP_HISTORY_CONCURRENCY if not
+        specified, default 4)
+    endpoint_timeout
+        Deadline in seconds for each TAP endpoint to answer a query history
+        request (optional, taken from $TAP_HISTORY_TIMEOUT if not specified,
+        default 10.0)
+    max_retries
+        How many times to retry a TAP endpoint's job list after a timeout,
+        connection failure or server error (optional, taken from
+        $TAP_HISTORY_RETRIES if not specified, default 2)
+    retry_delay
+        Base delay in seconds for exponential backoff between retries; the
+        actual delay is random, up to this doubled for each retry and at
+        most 5 seconds (optional, taken from $TAP_HISTORY_RETRY_DELAY if not
+        specified, default 0.5)
+    breaker_threshold
+        After this many consecutive failed job list requests, stop asking a
+        TAP endpoint for a while (optional, default 3)
+    breaker_cooldown
+        How long, in seconds, to leave a failing TAP endpoint alone before
+        trying it again (optional, default 60.0)
+    race_resolution
+        Whether to probe all TAP endpoints at once when resolving a bare
+        jobref ID, rather than one after another (optional, default `True`)
+    negative_cache_ttl
+        How long, in seconds, to remember that a bare jobref ID could not be
+        found on any endpoint (optional, default 60.0)
+    max_jobrefs
+        How many resolved jobref IDs, and how many jobref IDs that could not
+        be found, to remember; least recently used are forgotten first
+        (optional, default 10000)
+    discovery_cache
+        Cache of discovery answers (optional, created if not specified,
+        persisted in the user's cache directory)
+    history_ttl
+        How long, in seconds, a query history result may be reused to
+        answer later requests (optional, default 1.0)
+    full_refresh_interval
+        How long, in seconds, to keep asking each TAP endpoint only for
+        jobs newer than those already seen, before fetching its job list in
+        full again (optional, default 300.0)
     """
 
     def __init__(
@@ -59,10 +200,40 @@ class RSPClient:
         authed_client: AsyncClient | None = None,
         repertoire_url: str | None = None,
         logger: logging.Logger | None = None,
+        *,
+        max_concurrency: int | None = None,
+        endpoint_timeout: float | None = None,
+        max_retries: int | None = None,
+        retry_delay: float | None = None,
+        breaker_threshold: int = 3,
+        breaker_cooldown: float = 60.0,
+        race_resolution: bool = True,
+        negative_cache_ttl: float = 60.0,
+        max_jobrefs: int = 10000,
+        discovery_cache: DiscoveryCache | None = None,
+        history_ttl: float = 1.0,
+        full_refresh_interval: float = 300.0,
     ) -> None:
         if logger is None:
             logger = logging.getLogger(__name__)
         self._logger = logger
+        if max_concurrency is None:
+            max_concurrency = int(os.getenv("TAP_HISTORY_CONCURRENCY", "4"))
+        self._max_concurrency = max(1, max_concurrency)
+        if endpoint_timeout is None:
+            endpoint_timeout = float(os.getenv("TAP_HISTORY_TIMEOUT", "10.0"))
+        self._endpoint_timeout = endpoint_timeout
+        if max_retries is None:
+            max_retries = int(os.getenv("TAP_HISTORY_RETRIES", "2"))
+        self._max_retries = max(0, max_retries)
+        if retry_delay is None:
+            retry_delay = float(os.getenv("TAP_HISTORY_RETRY_DELAY", "0.5"))
+        self._retry_delay = retry_delay
+        self._breaker_threshold = breaker_threshold
+        self._breaker_cooldown = breaker_cooldown
+        self._breakers: dict[str, CircuitBreaker] = {}
+        self._race_resolution = race_resolution
+        self._negative_cache_ttl = negative_cache_ttl
         if anonymous_client is None:
             anonymous_client = AsyncClient(
                 headers={"Content-Type": "application/json"}
@@ -70,10 +241,8 @@ class RSPClient:
         self.anonymous_client = anonymous_client
         if authed_client is None:
             authed_client = AsyncClient(
-                headers={
-                    "Content-Type": "application/json",
-                    "Authorization": f"Bearer {_get_access_token()}",
-                },
+                auth=TokenAuth(),
+                headers={"Content-Type": "application/json"},
             )
         self.authed_client = authed_client
         if discovery_client is None:
@@ -81,7 +250,50 @@ class RSPClient:
                 anonymous_client, base_url=repertoire_url
             )
         self.discovery_client = discovery_client
+        if discovery_cache is None:
+            discovery_cache = DiscoveryCache(
+                discovery_client,
+                cache_file=_discovery_cache_file(),
+                base_url=repertoire_url,
+                logger=logger,
+            )
+        self._discovery = discovery_cache
         self.dataset_urls: dict[str, str] = {}
+        # Jobref ID to resolved JobRef, learned from query history, and
+        # jobref ID to expiry time for IDs we recently failed to find, both
+        # least recently used first.
+        self._max_jobrefs = max(0, max_jobrefs)
+        self._jobref_index: OrderedDict[str, JobRef] = OrderedDict()
+        self._absent_jobrefs: OrderedDict[str, float] = OrderedDict()
+        # In-flight query history fetches by limit, and the most recent
+        # result as (limit, expiry time, history).
+        self._history_ttl = history_ttl
+        self._history_flights: dict[int, asyncio.Task[HistoryResult]] = {}
+        self._recent_history: tuple[int, float, HistoryResult] | None = None
+        # The jobs last seen from each endpoint, for incremental refreshes.
+        self._full_refresh_interval = full_refresh_interval
+        self._endpoint_history: dict[str, _EndpointHistory] = {}
+        # Validators and parsed bodies, for conditional requests.
+        self._job_lists: ConditionalCache[list[dict[str, str]]] = (
+            ConditionalCache()
+        )
+        self._job_documents: ConditionalCache[str] = ConditionalCache()
+        self._document_flights: dict[str, asyncio.Task[str]] = {}
+
+    async def aclose(self) -> None:
+        """Stop the fetches running on behalf of callers, and the background
+        discovery refresh, and wait for them.
+
+        The HTTP clients are not closed, since they are not ours.
+        """
+        tasks: list[asyncio.Task[Any]] = [
+            *self._history_flights.values(),
+            *self._document_flights.values(),
+        ]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        await self._discovery.aclose()
 
     async def get_datasets(self) -> list[str]:
         """Get datasets present in the RSP instance.
@@ -91,9 +303,7 @@ class RSPClient:
         list[str]
            Datasets present in the RSP instance.
         """
-        datasets = await self.discovery_client.datasets()
-        self._logger.debug(f"Found datasets {datasets}")
-        return datasets
+        return list((await self._discovery.get()).datasets)
 
     async def get_tap_endpoints(self) -> dict[str, str]:
         """Get TAP endpoints in this RSP instance.
@@ -103,19 +313,25 @@ class RSPClient:
         dict[str, str]
             Map of dataset to its corresponding TAP endpoint.
         """
-        retval: dict[str, str] = {}
-        datasets = await self.get_datasets()
-        for dataset in datasets:
-            self._logger.debug(f"Finding TAP endpoint for dataset {dataset}")
-            url = await self.discovery_client.url_for_data("tap", dataset)
-            if url:
-                retval[dataset] = url
-                self.dataset_urls[dataset] = url
-                self._logger.debug(f"TAP URL for {dataset} is {url}")
-            else:
-                self._logger.warning(f"No TAP URL found for dataset {dataset}")
+        retval = dict((await self._discovery.get()).tap_urls)
+        self.dataset_urls.update(retval)
         return retval
 
+    async def get_tap_endpoint_groups(self) -> dict[str, list[str]]:
+        """Get distinct TAP endpoints in this RSP instance.
+
+        Several datasets may be served by the same TAP endpoint (for example,
+        dp02 and dp1).  Anything that talks to every endpoint should use
+        this rather than `get_tap_endpoints` so that each endpoint is only
+        asked once.
+
+        Returns
+        -------
+        dict[str, list[str]]
+            Map of TAP endpoint to the datasets it serves, in dataset order.
+        """
+        return _group_by_endpoint(await self.get_tap_endpoints())
+
     async def get_tap_endpoint_for_dataset(self, dataset: str) -> str | None:
         """Return the endpoint for a given dataset.
 
@@ -133,8 +349,12 @@ class RSPClient:
                 f"Returning cached TAP URL for {dataset}: {retval}"
             )
             return retval
+        if retval := (await self.get_tap_endpoints()).get(dataset):
+            return retval
         # Rescan datasets, return None if still not found.
-        return (await self.get_tap_endpoints()).get(dataset)
+        snapshot = await self._discovery.refresh()
+        self.dataset_urls.update(snapshot.tap_urls)
+        return snapshot.tap_urls.get(dataset)
 
     async def resolve_jobref_id(self, jobref_id: str) -> JobRef:
         """Return a resolved JobRef with dataset, ID, and endpoint for a
@@ -160,12 +380,19 @@ class RSPClient:
         -----
             If the jobref ID is in the canonical form `dataset:id`
         then we trust that the jobref exists in that dataset. If there
-        is no colon, then we iterate through the dataset endpoints
-        looking for a query with the jobref ID. In the event that a
-        given jobref ID exists for two endpoints, the first one
-        encountered will be returned. The likely cause of this is two
-        datasets that share an endpoint (e.g. dp02 and dp1); the odds
-        of an actual jobref ID collision are very low.
+        is no colon, then we ask the dataset endpoints for a query with
+        the jobref ID. Each distinct endpoint is only asked once; if it
+        is shared by several datasets (e.g. dp02 and dp1), the first of
+        those datasets is returned. With ``race_resolution`` set, all
+        endpoints are asked at once, the first to find the job wins, and
+        the outstanding probes are cancelled; otherwise they are asked in
+        turn. In the event that a given jobref ID exists for two
+        endpoints, whichever is found first will be returned; the odds of
+        an actual jobref ID collision are very low.
+
+            Bare jobref IDs seen in query history, or previously resolved,
+        are answered from an index without any requests.  IDs that could
+        not be found are remembered for ``negative_cache_ttl`` seconds.
         """
         self._logger.debug(f"Resolving jobref_id {jobref_id}")
         if jobref_id.find(":") > -1:
@@ -178,62 +405,466 @@ class RSPClient:
             return JobRef(
                 dataset=dataset, jobref_id=new_j_id, endpoint=endpoint
             )
-        endpoints = await self.get_tap_endpoints()
-        for dataset, endpoint in endpoints.items():
-            url = f"{endpoint}/async/{jobref_id}"
-            resp = await self.authed_client.get(url)
-            if resp.status_code == 200:
-                return JobRef(
-                    dataset=dataset, jobref_id=jobref_id, endpoint=endpoint
-                )
-            if resp.status_code != 404:
-                self._logger.warning(
-                    f"Unexpected status code {resp.status_code} from {url}"
+        if jobref := self._jobref_index.get(jobref_id):
+            self._jobref_index.move_to_end(jobref_id)
+            self._logger.debug(f"Found {jobref_id} in index: {jobref}")
+            return jobref
+        expiry = self._absent_jobrefs.get(jobref_id)
+        if expiry is not None:
+            if time.monotonic() < expiry:
+                msg = f"No dataset for jobref ID {jobref_id} (cached)"
+                raise UnknownDatasetError(msg)
+            del self._absent_jobrefs[jobref_id]
+        groups = await self.get_tap_endpoint_groups()
+        found: str | None = None
+        if self._race_resolution:
+            found = await self._race_jobref_probes(jobref_id, list(groups))
+        else:
+            for endpoint in groups:
+                if found := await self._probe_jobref(endpoint, jobref_id):
+                    break
+        if found is None:
+            self._remember_absent(jobref_id)
+            raise UnknownDatasetError(f"No dataset for jobref ID {jobref_id}")
+        jobref = JobRef(
+            dataset=groups[found][0], jobref_id=jobref_id, endpoint=found
+        )
+        self._remember_jobref(jobref)
+        return jobref
+
+    def _index_jobrefs(
+        self, endpoint: str, datasets: list[str], jobrefs: list[dict[str, str]]
+    ) -> None:
+        """Remember which dataset and endpoint own each jobref ID."""
+        # Oldest first, so that if the index overflows the newest stay.
+        for job in reversed(jobrefs):
+            if not (jobref_id := job.get("@id")):
+                continue
+            self._absent_jobrefs.pop(jobref_id, None)
+            self._remember_jobref(
+                JobRef(
+                    dataset=datasets[0], jobref_id=jobref_id, endpoint=endpoint
                 )
-        raise UnknownDatasetError(f"No dataset for jobref ID {jobref_id}")
+            )
+
+    def _remember_jobref(self, jobref: JobRef) -> None:
+        self._jobref_index[jobref.jobref_id] = jobref
+        self._jobref_index.move_to_end(jobref.jobref_id)
+        while len(self._jobref_index) > self._max_jobrefs:
+            self._jobref_index.popitem(last=False)
+
+    def _remember_absent(self, jobref_id: str) -> None:
+        now = time.monotonic()
+        self._absent_jobrefs.pop(jobref_id, None)
+        self._absent_jobrefs[jobref_id] = now + self._negative_cache_ttl
+        # The TTL is fixed, so entries expire in the order they were added.
+        while self._absent_jobrefs and (
+            len(self._absent_jobrefs) > self._max_jobrefs
+            or next(iter(self._absent_jobrefs.values())) <= now
+        ):
+            self._absent_jobrefs.popitem(last=False)
+
+    async def _probe_jobref(self, endpoint: str, jobref_id: str) -> str | None:
+        """Return the endpoint if it knows about the jobref ID, else None."""
+        url = f"{endpoint}/async/{jobref_id}"
+        try:
+            resp = await self.authed_client.get(url)
+        except HTTPError as exc:
+            self._logger.warning(f"Error requesting {url}: {exc!s}")
+            return None
+        if resp.status_code == 200:
+            # Worth keeping: the query text is usually wanted next.
+            self._job_documents.put(url, resp.headers, resp.text)
+            return endpoint
+        if resp.status_code != 404:
+            self._logger.warning(
+                f"Unexpected status code {resp.status_code} from {url}"
+            )
+        return None
+
+    async def _race_jobref_probes(
+        self, jobref_id: str, endpoints: list[str]
+    ) -> str | None:
+        """Probe all endpoints at once and return the first that knows
+        about the jobref ID, cancelling the rest.
+        """
+        tasks = [
+            asyncio.create_task(self._probe_jobref(ep, jobref_id))
+            for ep in endpoints
+        ]
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                if found := await next_done:
+                    return found
+            return None
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
 
     async def get_query_history(
         self, limit: int = 5
     ) -> dict[str, list[dict[str, str]]]:
-        """Return a dict of endpoint-to-last-limit query IDs.
+        """Return a dict of dataset to its last ``limit`` jobrefs.
+
+        This is `fetch_query_history` without the per-dataset status.
+        """
+        return (await self.fetch_query_history(limit)).jobs
+
+    async def fetch_query_history(self, limit: int = 5) -> HistoryResult:
+        """Return the last ``limit`` jobrefs for each dataset, and how the
+        request for each dataset went.
 
         Parameters
         ----------
         limit
             How many results to return.  Set to zero or negative for all
-            queries.
 
-        Returns
-        -------
-        dict[str, list[dict[str, str]]]
-            Outer key of the dict is the dataset name; each item of the list
-        is a jobref, which is a string-to-string mapping.
+        Notes
+        -----
+        Each distinct endpoint is asked once, and its jobs are reported for
+        every dataset it serves.  Endpoints are queried concurrently, at
+        most ``max_concurrency`` at a time.  An endpoint that does not answer
+        within ``endpoint_timeout`` seconds, or that fails with a connection
+        or server error, is retried up to ``max_retries`` times with
+        jittered exponential backoff.  If it still fails, its datasets are
+        marked failed and left out of the history.  The other datasets are
+        still returned, so one sick TAP service neither holds up nor blanks
+        the others.  An endpoint that has failed ``breaker_threshold`` times
+        in a row is not asked at all for ``breaker_cooldown`` seconds, and
+        its datasets are marked unavailable.
+
+        Concurrent callers share a single fetch: a request is answered from
+        any fetch in flight, or finished within the last ``history_ttl``
+        seconds, whose limit is at least as large.
         """
-        retval: dict[str, list[dict[str, str]]] = {}
-        params = {"last": str(limit)} if limit and limit > 0 else {}
-        endpoints = await self.get_tap_endpoints()
-        epoch = "1970-01-01T00:00:00.000Z"
-        for dataset, ep in endpoints.items():
-            resp = await self.authed_client.get(ep + "/async", params=params)
-            if resp.status_code >= 300:
-                msg = f"Status {resp.status_code} from {ep}/async; skipping"
-                self._logger.warning(msg)
-                continue
-            # This could be done with pyvo, but then you have to deal with
-            # astropy.Time, and since the textual representation of times
-            # sort lexically just fine, it ends up being more trouble than
-            # using xmltodict.
-            history = xmltodict.parse(resp.text, force_list=("uws:jobref",))
-            if jobrefs := history.get("uws:jobs", {}).get("uws:jobref"):
-                # Sort jobrefs by timestamp
-                jobrefs.sort(
-                    key=lambda e: (e.get("uws:creationTime", epoch)),
-                    reverse=True,
-                )
-                self._logger.debug(f"{dataset} jobs -> {jobrefs}")
-                retval[dataset] = jobrefs
+        recent = self._recent_history
+        if (
+            recent is not None
+            and time.monotonic() < recent[1]
+            and _covers(recent[0], limit)
+        ):
+            return _trim_history(recent[2], limit)
+        flight = next(
+            (
+                task
+                for flight_limit, task in self._history_flights.items()
+                if _covers(flight_limit, limit)
+            ),
+            None,
+        )
+        if flight is None:
+            flight = asyncio.create_task(self._fetch_query_history(limit))
+            self._history_flights[limit] = flight
+            flight.add_done_callback(
+                lambda task: self._finish_history_flight(limit, task)
+            )
+        # Shielded, so that one caller going away does not cancel the fetch
+        # for everyone else.
+        history = await asyncio.shield(flight)
+        return _trim_history(history, limit)
+
+    def _finish_history_flight(
+        self, limit: int, task: asyncio.Task[HistoryResult]
+    ) -> None:
+        if self._history_flights.get(limit) is task:
+            del self._history_flights[limit]
+        if task.cancelled() or task.exception() is not None:
+            return
+        expiry = time.monotonic() + self._history_ttl
+        self._recent_history = (limit, expiry, task.result())
+
+    async def iter_query_history(
+        self, limit: int = 5
+    ) -> AsyncGenerator[tuple[str, list[dict[str, str]], DatasetStatus]]:
+        """Yield the last ``limit`` jobrefs and the status for each dataset,
+        as soon as its endpoint has answered.
+
+        Endpoints are queried as in `fetch_query_history`, but results come
+        back in the order the endpoints answer rather than all at once.  A
+        recent enough result from `fetch_query_history` is reused.
+        """
+        recent = self._recent_history
+        if (
+            recent is not None
+            and time.monotonic() < recent[1]
+            and _covers(recent[0], limit)
+        ):
+            history = _trim_history(recent[2], limit)
+            for dataset, status in history.status.items():
+                yield dataset, history.jobs.get(dataset, []), status
+            return
+        async for item in self._iter_query_history(limit):
+            yield item
+
+    async def _iter_query_history(
+        self, limit: int
+    ) -> AsyncGenerator[tuple[str, list[dict[str, str]], DatasetStatus]]:
+        groups = _group_by_endpoint(await self.get_tap_endpoints())
+        semaphore = asyncio.Semaphore(self._max_concurrency)
+
+        async def get(
+            ep: str,
+        ) -> tuple[str, list[dict[str, str]] | None, DatasetStatus]:
+            jobrefs, status = await self._get_jobrefs(
+                ep, groups[ep], limit, semaphore
+            )
+            return ep, jobrefs, status
+
+        tasks = [asyncio.create_task(get(ep)) for ep in groups]
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                ep, jobrefs, status = await next_done
+                if jobrefs:
+                    self._index_jobrefs(ep, groups[ep], jobrefs)
+                for dataset in groups[ep]:
+                    yield dataset, list(jobrefs or []), status
+        finally:
+            # If our caller stopped listening, stop asking.
+            for task in tasks:
+                task.cancel()
+
+    async def _fetch_query_history(self, limit: int) -> HistoryResult:
+        jobs: dict[str, list[dict[str, str]]] = {}
+        statuses: dict[str, DatasetStatus] = {}
+        async for dataset, jobrefs, status in self._iter_query_history(limit):
+            if jobrefs:
+                jobs[dataset] = jobrefs
+            statuses[dataset] = status
+        # Report datasets in discovery order, not in order of answer.
+        order = await self.get_datasets()
+        retval = HistoryResult(jobs={}, status={})
+        for dataset in order:
+            if dataset in jobs:
+                retval.jobs[dataset] = jobs[dataset]
+            if dataset in statuses:
+                retval.status[dataset] = statuses[dataset]
         return retval
 
+    async def _get_jobrefs(
+        self,
+        endpoint: str,
+        datasets: list[str],
+        limit: int,
+        semaphore: asyncio.Semaphore,
+    ) -> tuple[list[dict[str, str]] | None, DatasetStatus]:
+        """Retrieve the newest ``limit`` jobrefs for a single TAP endpoint,
+        newest first, retrying transient failures.
+
+        Returns `None` for the jobrefs if the endpoint could not be asked or
+        did not answer, along with the status to report for its datasets.
+        """
+        dataset = ", ".join(datasets)
+        breaker = self._breakers.get(endpoint)
+        if breaker is None:
+            breaker = CircuitBreaker(
+                self._breaker_threshold, self._breaker_cooldown
+            )
+            self._breakers[endpoint] = breaker
+        if not breaker.allow():
+            self._logger.info(
+                f"Not asking {endpoint} after repeated failures;"
+                f" {dataset} missing from query history"
+            )
+            return None, DatasetStatus(
+                status=HistoryStatus.UNAVAILABLE,
+                detail="TAP service recently failing; will retry later",
+            )
+        # If we already hold enough recent, settled jobs from this endpoint,
+        # only ask for jobs created since the newest of them.
+        now = time.monotonic()
+        cached = self._endpoint_history.get(endpoint)
+        after: str | None = None
+        if (
+            cached is not None
+            and _covers(cached.limit, limit)
+            and now - cached.full_at < self._full_refresh_interval
+        ):
+            after = cached.newest()
+        # Every call must end up at the breaker, even one that fails in a
+        # way we did not expect, or a trial call that never reported back
+        # would keep the circuit open for good.  Being cancelled, because
+        # whoever wanted the history went away, says nothing about the
+        # endpoint, so it is not counted as a failure.
+        try:
+            jobrefs = await self._fetch_jobrefs_with_retries(
+                endpoint, limit, after, semaphore
+            )
+        except asyncio.CancelledError:
+            breaker.release()
+            raise
+        except _JobListError as exc:
+            breaker.record_failure()
+            self._logger.warning(
+                f"{exc!s}; {dataset} missing from query history"
+            )
+            return None, DatasetStatus(
+                status=HistoryStatus.FAILED, detail=str(exc)
+            )
+        except Exception as exc:
+            breaker.record_failure()
+            self._logger.exception(
+                f"Unexpected error asking {endpoint} for jobs;"
+                f" {dataset} missing from query history"
+            )
+            return None, DatasetStatus(
+                status=HistoryStatus.FAILED, detail=str(exc)
+            )
+        breaker.record_success()
+        if after is not None and cached is not None:
+            self._logger.debug(
+                f"{len(jobrefs)} new jobs from {endpoint} after {after}"
+            )
+            cached.jobs = merge_jobrefs(jobrefs, cached.jobs, cached.limit)
+            jobrefs = cached.jobs[:limit] if limit > 0 else cached.jobs
+        else:
+            self._endpoint_history[endpoint] = _EndpointHistory(
+                limit=limit, jobs=jobrefs, full_at=now
+            )
+        jobrefs = list(jobrefs)
+        self._logger.debug(f"{dataset} jobs -> {jobrefs}")
+        return jobrefs, DatasetStatus(status=HistoryStatus.OK)
+
+    async def _fetch_jobrefs_with_retries(
+        self,
+        endpoint: str,
+        limit: int,
+        after: str | None,
+        semaphore: asyncio.Semaphore,
+    ) -> list[dict[str, str]]:
+        """Call `_fetch_jobrefs`, retrying retriable failures with backoff.
+
+        Raises
+        ------
+        _JobListError
+            Raised if the last attempt failed.
+        """
+        attempt = 0
+        while True:
+            try:
+                async with semaphore:
+                    return await self._fetch_jobrefs(endpoint, limit, after)
+            except _JobListError as exc:
+                if not exc.retriable or attempt >= self._max_retries:
+                    raise
+                delay = backoff_delay(attempt, self._retry_delay, 5.0)
+                attempt += 1
+                self._logger.info(f"{exc!s}; retrying in {delay:.2f}s")
+                await asyncio.sleep(delay)
+
+    async def _fetch_jobrefs(
+        self, endpoint: str, limit: int, after: str | None = None
+    ) -> list[dict[str, str]]:
+        """Make a single request for a TAP endpoint's newest jobrefs,
+        optionally only those created after ``after``.
+
+        Raises
+        ------
+        _JobListError
+            Raised if the endpoint timed out or returned an error, saying
+            whether it is worth trying again.
+        """
+        url = f"{endpoint}/async"
+        params = {"last": str(limit)} if limit and limit > 0 else {}
+        if after is not None:
+            # UWS 1.1 AFTER filter.  Servers that ignore it send the whole
+            # list, which merges just the same.
+            params["AFTER"] = after
+        # This could be done with pyvo, but then you have to deal with
+        # astropy.Time, and since the textual representation of times
+        # sort lexically just fine, it ends up being more trouble than
+        # parsing it ourselves.  We parse the job list as it arrives and
+        # keep only the newest jobs, since some users have tens of thousands
+        # of them and not every TAP server honors "last".
+        key = str(URL(url, params=params))
+        headers = self._job_lists.headers(key)
+        parser = JobListParser(limit)
+        try:
+            async with (
+                asyncio.timeout(self._endpoint_timeout),
+                self.authed_client.stream(
+                    "GET", url, params=params, headers=headers
+                ) as resp,
+            ):
+                if resp.status_code == 304:
+                    if (cached := self._job_lists.get(key)) is not None:
+                        self._logger.debug(f"{url} not modified")
+                        return list(cached)
+                    # Evicted since we asked; asking again will get it all.
+                    raise _JobListError(
+                        f"Lost cached job list for {url}", retriable=True
+                    )
+                if resp.status_code >= 300:
+                    raise _JobListError(
+                        f"Status {resp.status_code} from {url}",
+                        retriable=resp.status_code in _RETRIABLE_STATUSES,
+                    )
+                async for chunk in resp.aiter_bytes():
+                    parser.feed(chunk)
+                jobrefs = parser.close()
+                self._job_lists.put(key, resp.headers, jobrefs)
+                return list(jobrefs)
+        except (TimeoutError, TimeoutException) as exc:
+            raise _JobListError(
+                f"No response from {url} within {self._endpoint_timeout}s",
+                retriable=True,
+            ) from exc
+        except TransportError as exc:
+            raise _JobListError(
+                f"Cannot reach {url}: {exc!s}", retriable=True
+            ) from exc
+        except ParseError as exc:
+            raise _JobListError(
+                f"Cannot parse jobs from {url}: {exc!s}", retriable=False
+            ) from exc
+
+    async def get_job_document(self, jobref: JobRef) -> str:
+        """Return the UWS job document for a jobref.
+
+        A copy we already hold is revalidated with a conditional request,
+        and reused if the TAP service says it has not changed.  Concurrent
+        requests for the same document (for instance, the same job seen
+        through two datasets served by one endpoint) share one fetch.
+
+        Raises
+        ------
+        httpx.HTTPStatusError
+            Raised if the TAP service returned an error.
+        """
+        url = f"{jobref.endpoint}/async/{jobref.jobref_id}"
+        flight = self._document_flights.get(url)
+        if flight is None:
+            flight = asyncio.create_task(self._fetch_job_document(url))
+            self._document_flights[url] = flight
+            flight.add_done_callback(
+                lambda task: self._finish_document_flight(url, task)
+            )
+        # Shielded, so that one caller going away does not cancel the fetch
+        # for everyone else.
+        return await asyncio.shield(flight)
+
+    def _finish_document_flight(
+        self, url: str, task: asyncio.Task[str]
+    ) -> None:
+        if self._document_flights.get(url) is task:
+            del self._document_flights[url]
+        if not task.cancelled():
+            # Retrieve the exception, if any, in case every caller has gone.
+            task.exception()
+
+    async def _fetch_job_document(self, url: str) -> str:
+        headers = self._job_documents.headers(url)
+        resp = await self.authed_client.get(url, headers=headers)
+        if resp.status_code == 304:
+            if (document := self._job_documents.get(url)) is not None:
+                self._logger.debug(f"{url} not modified")
+                return document
+            # Evicted since we asked.
+            resp = await self.authed_client.get(url)
+        resp.raise_for_status()
+        self._job_documents.put(url, resp.headers, resp.text)
+        return resp.text
+
     async def get_environment_name(self) -> str | None:
         """Get the environment name of this RSP instance.
 
@@ -249,7 +880,7 @@ class RSPClient:
         it shouldn't be treated as an endpoint; that's what the landing page
         URL is for.
         """
-        return await self.discovery_client.environment_name()
+        return (await self._discovery.get()).environment_name
 
     async def get_logout_url(self) -> str | None:
         """Get the URL used to log out of this RSP instance.
@@ -259,7 +890,7 @@ class RSPClient:
         str
             URL used for logout.
         """
-        url = await self.discovery_client.url_for_ui("logout")
+        url = (await self._discovery.get()).logout_url
         self._logger.debug(f"Logout URL is {url}")
         return url
 
@@ -271,7 +902,7 @@ class RSPClient:
         str
             URL used for landing page.
         """
-        url = await self.discovery_client.url_for_ui("squareone")
+        url = (await self._discovery.get()).landing_page_url
         self._logger.debug(f"Landing page URL is {url}")
         return url
 
@@ -283,6 +914,6 @@ class RSPClient:
         str
             URL used for the Times Square service.
         """
-        url = await self.discovery_client.url_for_internal("times-square")
+        url = (await self._discovery.get()).times_square_url
         self._logger.debug(f"Times Square URL is {url}")
         return url
@@ -0,0 +1,152 @@
+"""Cached snapshot of the discovery information the extension uses."""
+
+import asyncio
+import logging
+import os
+import time
+from pathlib import Path
+
+from pydantic import ValidationError
+from rubin.repertoire import DiscoveryClient
+
+from ..models.discovery import DiscoverySnapshot
+
+
+class DiscoveryCache:
+    """Hold a single discovery snapshot in memory and on disk.
+
+    The snapshot is refreshed in the background once it is older than
+    ``ttl``; until the refresh completes, the stale snapshot keeps being
+    served.  Each refreshed snapshot is also written to ``cache_file``, so
+    that a newly-started lab can serve the previous answers immediately
+    while it revalidates them.
+
+    Parameters
+    ----------
+    discovery_client
+        DiscoveryClient used to build snapshots.
+    cache_file
+        Where to persist the snapshot (optional; if not specified, the
+        snapshot is only held in memory).
+    base_url
+        Repertoire URL the discovery client talks to (optional, taken from
+        $REPERTOIRE_BASE_URL if not specified).  A snapshot on disk from a
+        different Repertoire is ignored.
+    ttl
+        How long, in seconds, a snapshot is considered fresh.
+    logger
+        Logger to use (optional, created if not specified)
+    """
+
+    def __init__(
+        self,
+        discovery_client: DiscoveryClient,
+        cache_file: Path | None = None,
+        base_url: str | None = None,
+        ttl: float = 300.0,
+        logger: logging.Logger | None = None,
+    ) -> None:
+        self._discovery_client = discovery_client
+        self._cache_file = cache_file
+        self._base_url = base_url or os.getenv("REPERTOIRE_BASE_URL")
+        self._ttl = ttl
+        self._logger = logger or logging.getLogger(__name__)
+        self._snapshot: DiscoverySnapshot | None = None
+        self._lock = asyncio.Lock()
+        self._refresh_task: asyncio.Task[None] | None = None
+
+    async def get(self) -> DiscoverySnapshot:
+        """Return the current snapshot, scheduling a refresh if it is stale.
+
+        Only the very first call in a lab with no snapshot on disk waits for
+        Repertoire.
+        """
+        if self._snapshot is None:
+            async with self._lock:
+                if self._snapshot is None:
+                    self._snapshot = await asyncio.to_thread(self._load)
+                    if self._snapshot is None:
+                        return await self._refresh()
+                    # Warm start: serve what we had, but revalidate.
+                    self._schedule_refresh()
+                    return self._snapshot
+        if time.time() - self._snapshot.fetched_at > self._ttl:
+            self._schedule_refresh()
+        return self._snapshot
+
+    async def refresh(self) -> DiscoverySnapshot:
+        """Fetch a new snapshot now and return it."""
+        async with self._lock:
+            return await self._refresh()
+
+    async def _refresh(self) -> DiscoverySnapshot:
+        dc = self._discovery_client
+        datasets = await dc.datasets()
+        self._logger.debug(f"Found datasets {datasets}")
+        tap_urls: dict[str, str] = {}
+        for dataset in datasets:
+            if url := await dc.url_for_data("tap", dataset):
+                tap_urls[dataset] = url
+                self._logger.debug(f"TAP URL for {dataset} is {url}")
+            else:
+                self._logger.warning(f"No TAP URL found for dataset {dataset}")
+        snapshot = DiscoverySnapshot(
+            base_url=self._base_url,
+            fetched_at=time.time(),
+            datasets=datasets,
+            tap_urls=tap_urls,
+            environment_name=await dc.environment_name(),
+            logout_url=await dc.url_for_ui("logout"),
+            landing_page_url=await dc.url_for_ui("squareone"),
+            times_square_url=await dc.url_for_internal("times-square"),
+        )
+        self._snapshot = snapshot
+        await asyncio.to_thread(self._save, snapshot)
+        return snapshot
+
+    async def aclose(self) -> None:
+        """Stop any background refresh, and wait for it."""
+        task, self._refresh_task = self._refresh_task, None
+        if task is not None:
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+
+    def _schedule_refresh(self) -> None:
+        if self._refresh_task is None or self._refresh_task.done():
+            self._refresh_task = asyncio.create_task(self._background())
+
+    async def _background(self) -> None:
+        try:
+            await self.refresh()
+        except Exception as exc:
+            # Keep serving the stale snapshot; we'll try again next time.
+            self._logger.warning(f"Discovery refresh failed: {exc!s}")
+
+    def _load(self) -> DiscoverySnapshot | None:
+        if self._cache_file is None:
+            return None
+        try:
+            snapshot = DiscoverySnapshot.model_validate_json(
+                self._cache_file.read_text()
+            )
+        except (OSError, ValidationError, ValueError) as exc:
+            self._logger.debug(f"No usable discovery cache: {exc!s}")
+            return None
+        if snapshot.base_url != self._base_url:
+            self._logger.debug(
+                f"Ignoring discovery cache for {snapshot.base_url}"
+            )
+            return None
+        self._logger.debug(f"Loaded discovery cache from {self._cache_file}")
+        return snapshot
+
+    def _save(self, snapshot: DiscoverySnapshot) -> None:
+        if self._cache_file is None:
+            return
+        try:
+            self._cache_file.parent.mkdir(parents=True, exist_ok=True)
+            tmp = self._cache_file.with_suffix(".tmp")
+            tmp.write_text(snapshot.model_dump_json())
+            tmp.replace(self._cache_file)
+        except OSError as exc:
+            self._logger.warning(f"Cannot write discovery cache: {exc!s}")
@@ -0,0 +1,365 @@
+"""TAP query history and query text, shared by all query handlers."""
+
+import asyncio
+import logging
+import os
+from typing import Any
+
+import xmltodict
+from pydantic import ValidationError
+
+from ..models.query import (
+    QueryHistoryEvent,
+    QueryHistoryResponse,
+    TAPQuery,
+)
+from ._uws import TERMINAL_PHASES
+from .cache import LRUCache, PersistentCache
+from .clients import RSPClient, _covers
+
+# How many past histories, of different lengths, to keep for stale answers.
+_MAX_LAST_GOOD = 4
+
+
+def _str_or_none(value: Any) -> str | None:
+    # Nil UWS elements, such as the end time of a running job, are parsed
+    # as a dict of their attributes.
+    return value if isinstance(value, str) else None
+
+
+def _int_or_none(value: Any) -> int | None:
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _parse_job(job: str, document: str) -> TAPQuery:
+    """Build a `TAPQuery` from a UWS job document.
+
+    Raises
+    ------
+    RuntimeError
+        Raised if the job has no query text.
+    """
+    # This could be done with pyvo, but it's really not any easier,
+    # because you still have to step through each parameter.
+    obj = (
+        xmltodict.parse(
+            document, force_list=("uws:parameter", "uws:result")
+        ).get("uws:job")
+        or {}
+    )
+    qtext = None
+    for parm in (obj.get("uws:parameters") or {}).get("uws:parameter", []):
+        if isinstance(parm, dict) and parm.get("@id") == "QUERY":
+            qtext = parm.get("#text")
+            break
+    if not qtext:
+        raise RuntimeError(f"Job {job} did not have associated query text")
+    row_count = None
+    for result in (obj.get("uws:results") or {}).get("uws:result", []):
+        if isinstance(result, dict) and "@rowCount" in result:
+            row_count = _int_or_none(result["@rowCount"])
+            break
+    return TAPQuery(
+        jobref=job,
+        text=qtext,
+        phase=_str_or_none(obj.get("uws:phase")),
+        creation_time=_str_or_none(obj.get("uws:creationTime")),
+        start_time=_str_or_none(obj.get("uws:startTime")),
+        end_time=_str_or_none(obj.get("uws:endTime")),
+        execution_duration=_int_or_none(
+            _str_or_none(obj.get("uws:executionDuration"))
+        ),
+        row_count=row_count,
+    )
+
+
+class QueryHistory:
+    """Look up the query text for TAP jobs, and publish history changes.
+
+    Query text is looked up in memory, then on disk, then from the TAP
+    service.  The last history built is kept, to be served when the TAP
+    services are slow.
+
+    Subscribers are sent a `QueryHistoryEvent` for every job in the
+    history when they subscribe, and then whenever a job appears or its
+    phase or text changes.  While anyone is subscribed, the history is
+    polled in the background.
+
+    Parameters
+    ----------
+    rsp_client
+        Client for RSP services.
+    cache
+        In-memory query text cache.
+    store
+        On-disk query text cache (optional).
+    logger
+        Logger to use (optional, created if not specified)
+    count
+        How many jobs per dataset to poll for (optional, default 5)
+    poll_interval
+        Seconds between polls (optional, taken from
+        $QUERY_HISTORY_POLL_INTERVAL if not specified, default 30.0)
+    """
+
+    def __init__(
+        self,
+        rsp_client: RSPClient,
+        cache: LRUCache,
+        store: PersistentCache | None = None,
+        logger: logging.Logger | None = None,
+        *,
+        count: int = 5,
+        poll_interval: float | None = None,
+    ) -> None:
+        self._rsp_client = rsp_client
+        self._cache = cache
+        self._store = store
+        self._logger = logger or logging.getLogger(__name__)
+        self._count = count
+        if poll_interval is None:
+            poll_interval = float(
+                os.getenv("QUERY_HISTORY_POLL_INTERVAL", "30.0")
+            )
+        self._poll_interval = poll_interval
+        # Last published state of each job in the history, by jobref.
+        self._known: dict[str, QueryHistoryEvent] = {}
+        self._subscribers: set[asyncio.Queue[QueryHistoryEvent]] = set()
+        self._poller: asyncio.Task[None] | None = None
+        # The last history we built for each number of jobs per dataset,
+        # newest last, and refreshes nobody may be waiting for any more.
+        self._last_good: dict[int, QueryHistoryResponse] = {}
+        self._refreshes: set[asyncio.Task[QueryHistoryResponse]] = set()
+
+    async def get_query_text_list(
+        self, job_ids: dict[str, list[dict[str, str]]]
+    ) -> dict[str, list[TAPQuery]]:
+        """For each job ID, get the query text.  This will be returned
+        to the UI to be used as a hover tooltip.
+
+        Each time through, we both get results we already have for the
+        cache, and update the cache if we get new results.
+
+        Retrievals run concurrently, at most $QUERY_TEXT_CONCURRENCY
+        (default 8) at a time; each dataset's list keeps the order it had
+        in ``job_ids``.
+        """
+        self._logger.info(f"Requesting query history for {job_ids}")
+        semaphore = asyncio.Semaphore(
+            int(os.getenv("QUERY_TEXT_CONCURRENCY", "8"))
+        )
+
+        async def get_text(
+            dataset: str, job: dict[str, str]
+        ) -> TAPQuery | None:
+            jobkey = ""
+            try:
+                jobkey = f"{dataset}:{job['@id']}"
+                async with semaphore:
+                    return await self.get_query_text_job(jobkey)
+            except Exception:
+                if jobkey:
+                    self._logger.exception(
+                        f"job {jobkey} text retrieval failed"
+                    )
+                else:
+                    self._logger.exception(
+                        "text retrieval failed for unknown job"
+                    )
+            return None
+
+        texts = await asyncio.gather(
+            *(
+                asyncio.gather(*(get_text(dataset, job) for job in jobs))
+                for dataset, jobs in job_ids.items()
+            )
+        )
+        retval: dict[str, list[TAPQuery]] = {}
+        for dataset, qtexts in zip(job_ids, texts, strict=True):
+            found = [x for x in qtexts if x]
+            if found:
+                retval[dataset] = found
+        return retval
+
+    async def get_query_text_job(self, job: str) -> TAPQuery:
+        """Get the query text, and what else the UWS job document says
+        about the job, for a single job given as dataset:id.
+
+        Only jobs in a terminal phase are cached, since the job document
+        of any other job will still change.
+        """
+        if (query := self._from_cache(job, self._cache.get(job))) is not None:
+            return query
+        if self._store is not None:
+            value = await asyncio.to_thread(self._store.get, job)
+            if (query := self._from_cache(job, value)) is not None:
+                self._cache.put(job, query.model_dump_json())
+                return query
+        jobref = await self._rsp_client.resolve_jobref_id(job)
+        self._logger.debug(f"{job} -> {jobref}")
+        document = await self._rsp_client.get_job_document(jobref)
+        query = _parse_job(job, document)
+        self._logger.debug(f"{job} -> '{query.text}'")
+        if query.phase in TERMINAL_PHASES:
+            value = query.model_dump_json()
+            self._cache.put(job, value)
+            if self._store is not None:
+                await asyncio.to_thread(self._store.put, job, value)
+        return query
+
+    def _from_cache(self, job: str, value: str | None) -> TAPQuery | None:
+        if value is None:
+            return None
+        try:
+            return TAPQuery.model_validate_json(value)
+        except ValidationError:
+            # Cached by an older version as bare query text.  Fetch it again
+            # to get the rest of what the job document says.
+            self._logger.debug(f"Refreshing old cache entry for {job}")
+            return None
+
+    async def get_history(
+        self, count: int, deadline: float | None = None
+    ) -> QueryHistoryResponse:
+        """Return the query history, with query text and dataset status.
+
+        Parameters
+        ----------
+        count
+            How many jobs per dataset to return.
+        deadline
+            How long, in seconds, to wait for the TAP services (optional,
+            wait as long as it takes if not specified).  If they have not
+            answered by then, the last history we got is returned instead,
+            marked stale, and the refresh carries on in the background;
+            its changes are published to subscribers when it finishes.
+            With no earlier history to fall back on, we wait regardless.
+        """
+        task = asyncio.create_task(self.refresh(count))
+        self._refreshes.add(task)
+        task.add_done_callback(self._finish_refresh)
+        # The most recent history with enough jobs to answer from.
+        last = next(
+            (
+                response
+                for have, response in reversed(self._last_good.items())
+                if _covers(have, count)
+            ),
+            None,
+        )
+        if deadline is None or last is None:
+            return await asyncio.shield(task)
+        try:
+            async with asyncio.timeout(deadline):
+                return await asyncio.shield(task)
+        except TimeoutError:
+            self._logger.info(
+                f"No query history within {deadline}s; serving stale history"
+            )
+        trimmed = {
+            dataset: queries[:count] if count > 0 else queries
+            for dataset, queries in last.history.items()
+        }
+        return last.model_copy(update={"history": trimmed, "stale": True})
+
+    def _finish_refresh(
+        self, task: asyncio.Task[QueryHistoryResponse]
+    ) -> None:
+        self._refreshes.discard(task)
+        if not task.cancelled() and (exc := task.exception()) is not None:
+            self._logger.warning(f"Query history refresh failed: {exc!s}")
+
+    async def refresh(self, count: int | None = None) -> QueryHistoryResponse:
+        """Fetch the query history and its text, and publish any changes.
+
+        Parameters
+        ----------
+        count
+            How many jobs per dataset to fetch, zero or less for all
+            (optional, defaults to the polling count)
+        """
+        if count is None:
+            count = self._count
+        result = await self._rsp_client.fetch_query_history(count)
+        history = await self.get_query_text_list(result.jobs)
+        self._publish_changes(result.jobs, history)
+        response = QueryHistoryResponse(history=history, status=result.status)
+        # Moved to the end, so it is the first choice of its peers.
+        self._last_good.pop(count, None)
+        self._last_good[count] = response
+        while len(self._last_good) > _MAX_LAST_GOOD:
+            del self._last_good[next(iter(self._last_good))]
+        return response
+
+    def _publish_changes(
+        self,
+        jobs: dict[str, list[dict[str, str]]],
+        history: dict[str, list[TAPQuery]],
+    ) -> None:
+        text_by_key = {q.jobref: q.text for qs in history.values() for q in qs}
+        known: dict[str, QueryHistoryEvent] = {}
+        for dataset, jobrefs in jobs.items():
+            for job in jobrefs:
+                if "@id" not in job:
+                    continue
+                key = f"{dataset}:{job['@id']}"
+                event = QueryHistoryEvent(
+                    dataset=dataset,
+                    jobref=key,
+                    phase=job.get("uws:phase"),
+                    creation_time=job.get("uws:creationTime"),
+                    text=text_by_key.get(key),
+                )
+                known[key] = event
+                if self._known.get(key) != event:
+                    self._publish(event)
+        # Forget jobs that have dropped out of the history.
+        self._known = known
+
+    def subscribe(self) -> asyncio.Queue[QueryHistoryEvent]:
+        """Start receiving history events, and polling if not already.
+
+        The returned queue is primed with the current state of every job
+        in the history.  Pass it to `unsubscribe` when done.
+        """
+        queue: asyncio.Queue[QueryHistoryEvent] = asyncio.Queue()
+        for event in self._known.values():
+            queue.put_nowait(event)
+        self._subscribers.add(queue)
+        if self._poller is None or self._poller.done():
+            self._poller = asyncio.create_task(self._poll())
+        return queue
+
+    def unsubscribe(self, queue: asyncio.Queue[QueryHistoryEvent]) -> None:
+        """Stop receiving history events.
+
+        Polling stops once there are no subscribers left.
+        """
+        self._subscribers.discard(queue)
+
+    async def aclose(self) -> None:
+        """Stop polling and any background refreshes, and wait for them."""
+        self._subscribers.clear()
+        tasks: list[asyncio.Task[Any]] = [*self._refreshes]
+        if self._poller is not None:
+            tasks.append(self._poller)
+            self._poller = None
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    def _publish(self, event: QueryHistoryEvent) -> None:
+        for queue in self._subscribers:
+            queue.put_nowait(event)
+
+    async def _poll(self) -> None:
+        while self._subscribers:
+            try:
+                await self.refresh()
+            except Exception:
+                # Keep going: the next poll may well succeed.
+                self._logger.exception("Query history poll failed")
+            await asyncio.sleep(self._poll_interval)
@@ -0,0 +1,245 @@
+"""Extension-wide pooled HTTP clients.
+
+Every handler that talks to another service gets its HTTP client from the
+single `HTTPClientManager` stored in the Tornado settings, so that repeated
+calls to the same RSP hosts reuse warm keep-alive connections.  The pools
+are closed when the Jupyter server shuts down.
+"""
+
+import asyncio
+import logging
+import os
+from collections.abc import AsyncIterator, Generator
+from importlib.util import find_spec
+from typing import Any
+
+from httpx import (
+    AsyncBaseTransport,
+    AsyncByteStream,
+    AsyncClient,
+    AsyncHTTPTransport,
+    Auth,
+    Client,
+    Limits,
+    Request,
+    Response,
+    Timeout,
+)
+
+from ._utils import TokenProvider, _token_provider
+
+SETTINGS_KEY = "rsp_http"
+
+
+class TokenAuth(Auth):
+    """Send our Gafaelfawr token as a bearer token.
+
+    The token comes from a `TokenProvider` on every request, so a rotated
+    token is used as soon as the token file changes, without rebuilding the
+    client or restarting the lab.
+
+    Parameters
+    ----------
+    provider
+        Token provider (optional, defaults to the extension-wide one)
+    """
+
+    def __init__(self, provider: TokenProvider | None = None) -> None:
+        self._provider = provider or _token_provider
+
+    def auth_flow(
+        self, request: Request
+    ) -> Generator[Request, Response, None]:
+        request.headers["Authorization"] = f"Bearer {self._provider.get()}"
+        yield request
+
+
+class _ReleasingStream(AsyncByteStream):
+    """Response body that gives back a per-host slot once it is closed."""
+
+    def __init__(
+        self, stream: AsyncByteStream, semaphore: asyncio.Semaphore
+    ) -> None:
+        self._stream = stream
+        self._semaphore = semaphore
+        self._released = False
+
+    async def __aiter__(self) -> AsyncIterator[bytes]:
+        async for chunk in self._stream:
+            yield chunk
+
+    async def aclose(self) -> None:
+        try:
+            await self._stream.aclose()
+        finally:
+            if not self._released:
+                self._released = True
+                self._semaphore.release()
+
+
+class _PerHostLimitTransport(AsyncBaseTransport):
+    """Transport that caps the number of concurrent requests per host.
+
+    httpx only limits connections for the whole pool; this keeps one busy
+    service from using up every connection in it.
+    """
+
+    def __init__(self, transport: AsyncBaseTransport, per_host: int) -> None:
+        self._transport = transport
+        self._per_host = per_host
+        self._semaphores: dict[str, asyncio.Semaphore] = {}
+
+    async def handle_async_request(self, request: Request) -> Response:
+        host = request.url.netloc.decode()
+        semaphore = self._semaphores.setdefault(
+            host, asyncio.Semaphore(self._per_host)
+        )
+        await semaphore.acquire()
+        try:
+            resp = await self._transport.handle_async_request(request)
+        except BaseException:
+            semaphore.release()
+            raise
+        if not isinstance(resp.stream, AsyncByteStream):
+            # Shouldn't happen with an async transport, but don't leak
+            # the slot if it does.
+            semaphore.release()
+            return resp
+        return Response(
+            status_code=resp.status_code,
+            headers=resp.headers,
+            stream=_ReleasingStream(resp.stream, semaphore),
+            extensions=resp.extensions,
+        )
+
+    async def aclose(self) -> None:
+        await self._transport.aclose()
+
+
+class HTTPClientManager:
+    """Own the HTTP connection pools shared by all RSP handlers.
+
+    Each setting may be given explicitly; otherwise it is taken from the
+    environment variable named below, and then from the default.
+
+    Parameters
+    ----------
+    max_connections
+        Maximum connections in each pool ($RSP_HTTP_MAX_CONNECTIONS, 20)
+    max_keepalive
+        Maximum idle keep-alive connections in each pool
+        ($RSP_HTTP_MAX_KEEPALIVE, 10)
+    keepalive_expiry
+        Seconds an idle connection is kept ($RSP_HTTP_KEEPALIVE_EXPIRY, 60.0)
+    max_per_host
+        Maximum concurrent requests to any single host
+        ($RSP_HTTP_MAX_PER_HOST, 8)
+    timeout
+        Default request timeout in seconds ($RSP_HTTP_TIMEOUT, 30.0)
+    http2
+        Whether to use HTTP/2 where the server supports it ($RSP_HTTP2,
+        default off).  Requires the optional ``h2`` package; ignored with a
+        warning if it is not installed.
+    logger
+        Logger to use (optional, created if not specified)
+    """
+
+    def __init__(
+        self,
+        *,
+        max_connections: int | None = None,
+        max_keepalive: int | None = None,
+        keepalive_expiry: float | None = None,
+        max_per_host: int | None = None,
+        timeout: float | None = None,
+        http2: bool | None = None,
+        logger: logging.Logger | None = None,
+    ) -> None:
+        self._logger = logger or logging.getLogger(__name__)
+        if max_connections is None:
+            max_connections = int(os.getenv("RSP_HTTP_MAX_CONNECTIONS", "20"))
+        if max_keepalive is None:
+            max_keepalive = int(os.getenv("RSP_HTTP_MAX_KEEPALIVE", "10"))
+        if keepalive_expiry is None:
+            keepalive_expiry = float(
+                os.getenv("RSP_HTTP_KEEPALIVE_EXPIRY", "60.0")
+            )
+        if max_per_host is None:
+            max_per_host = int(os.getenv("RSP_HTTP_MAX_PER_HOST", "8"))
+        if timeout is None:
+            timeout = float(os.getenv("RSP_HTTP_TIMEOUT", "30.0"))
+        if http2 is None:
+            http2 = bool(os.getenv("RSP_HTTP2"))
+        if http2 and find_spec("h2") is None:
+            self._logger.warning("HTTP/2 requested but h2 is not installed")
+            http2 = False
+        self._limits = Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_keepalive,
+            keepalive_expiry=keepalive_expiry,
+        )
+        self._max_per_host = max(1, max_per_host)
+        self._timeout = Timeout(timeout)
+        self._http2 = http2
+        self._anonymous_client: AsyncClient | None = None
+        self._authed_client: AsyncClient | None = None
+        self._sync_client: Client | None = None
+
+    @classmethod
+    def from_settings(cls, settings: dict[str, Any]) -> "HTTPClientManager":
+        """Return the manager stored in Tornado settings, creating it if
+        the extension loader has not already done so.
+        """
+        if SETTINGS_KEY not in settings:
+            settings[SETTINGS_KEY] = cls()
+        return settings[SETTINGS_KEY]
+
+    def _make_async_client(self, auth: Auth | None = None) -> AsyncClient:
+        transport = _PerHostLimitTransport(
+            AsyncHTTPTransport(limits=self._limits, http2=self._http2),
+            self._max_per_host,
+        )
+        return AsyncClient(
+            auth=auth,
+            headers={"Content-Type": "application/json"},
+            timeout=self._timeout,
+            transport=transport,
+        )
+
+    @property
+    def anonymous_client(self) -> AsyncClient:
+        """Pooled client for requests that do not need a token."""
+        if self._anonymous_client is None:
+            self._anonymous_client = self._make_async_client()
+        return self._anonymous_client
+
+    @property
+    def authed_client(self) -> AsyncClient:
+        """Pooled client that sends our current Gafaelfawr token."""
+        if self._authed_client is None:
+            self._authed_client = self._make_async_client(TokenAuth())
+        return self._authed_client
+
+    @property
+    def sync_client(self) -> Client:
+        """Pooled blocking client, for code that is not async."""
+        if self._sync_client is None:
+            self._sync_client = Client(
+                limits=self._limits,
+                timeout=self._timeout,
+                http2=self._http2,
+                follow_redirects=True,
+            )
+        return self._sync_client
+
+    async def aclose(self) -> None:
+        """Close all pools."""
+        for client in (self._anonymous_client, self._authed_client):
+            if client is not None:
+                await client.aclose()
+        if self._sync_client is not None:
+            self._sync_client.close()
+        self._anonymous_client = None
+        self._authed_client = None
+        self._sync_client = None
+        self._logger.debug("Closed RSP HTTP client pools")
@@ -3,11 +3,12 @@
 import os
 from typing import Any
 
-import requests
 import tornado
 from jupyter_server.base.handlers import APIHandler
 from jupyter_server.utils import url_path_join as ujoin
 
+from .httpclients import HTTPClientManager
+
 
 class HubHandler(APIHandler):
     """
@@ -23,7 +24,7 @@ class HubHandler(APIHandler):
         return self.settings["lsstquery"]
 
     @tornado.web.authenticated
-    def delete(self) -> None:
+    async def delete(self) -> None:
         """
         Send a DELETE to the Hub API, which will result in this Lab
         instance being terminated (potentially, along with its namespace).
@@ -47,4 +48,5 @@ class HubHandler(APIHandler):
         # Boom goes the dynamite.
         self.log.info(f"Requesting hub shutdown from {endpoint}")
         headers = {"Authorization": f"token {token}"}
-        requests.delete(endpoint, headers=headers, timeout=30)
+        http = HTTPClientManager.from_settings(self.settings)
+        await http.anonymous_client.delete(endpoint, headers=headers)
@@ -1,23 +1,116 @@
 """Handler Module to provide an endpoint for templated queries."""
 
+import asyncio
 import json
+import logging
 import os
 from pathlib import Path
-from urllib.parse import urljoin
+from typing import Any
 
 import tornado
-import xmltodict
-from httpx import ReadTimeout
 from jupyter_server.base.handlers import APIHandler
 
 from ..models.query import (
-    NotANotebookError,
-    TAPQuery,
+    DatasetHistory,
+    DatasetStatus,
+    NotebookBody,
     UnimplementedQueryResolutionError,
     UnsupportedQueryTypeError,
 )
-from ._utils import _peel_route, _write_notebook_response
+from ..models.tutorials import UserEnvironmentError
+from ._background import Debouncer
+from ._utils import (
+    _get_cache_dir,
+    _peel_route,
+    _read_text_or_none,
+    _write_notebook_response,
+)
+from .cache import LRUCache, PersistentCache
 from .clients import RSPClient
+from .history import QueryHistory
+from .httpclients import HTTPClientManager
+from .templates import NotebookTemplates
+
+
+def _make_cache() -> LRUCache:
+    """Create the in-memory query text cache.
+
+    It is bounded by $QUERY_TEXT_MEMORY_CACHE_MAX_ENTRIES (default 1000)
+    entries and $QUERY_TEXT_MEMORY_CACHE_MAX_BYTES (default 8 MiB).
+    """
+    return LRUCache(
+        max_entries=int(
+            os.getenv("QUERY_TEXT_MEMORY_CACHE_MAX_ENTRIES", "1000")
+        ),
+        max_size=int(
+            os.getenv(
+                "QUERY_TEXT_MEMORY_CACHE_MAX_BYTES", str(8 * 1024 * 1024)
+            )
+        ),
+    )
+
+
+def _make_store(log: logging.Logger) -> PersistentCache | None:
+    """Create the on-disk query text cache, which outlives the lab.
+
+    Query text never changes once a job exists, so entries never expire;
+    the cache is capped at $QUERY_TEXT_CACHE_MAX_ENTRIES (default 10000)
+    entries, least recently used evicted first.
+    """
+    try:
+        path = _get_cache_dir() / "query_text.sqlite3"
+    except UserEnvironmentError:
+        log.warning("No home directory; not persisting query text")
+        return None
+    max_entries = int(os.getenv("QUERY_TEXT_CACHE_MAX_ENTRIES", "10000"))
+    return PersistentCache(path, max_entries=max_entries, logger=log)
+
+
+def _get_query_state(
+    settings: dict[str, Any], log: logging.Logger
+) -> dict[str, Any]:
+    """Return the state shared by all query handlers, creating whatever
+    is not there yet.
+    """
+    if "query" not in settings:
+        settings["query"] = {}
+    state = settings["query"]
+    if "cache" not in state:
+        state["cache"] = _make_cache()
+    if "store" not in state:
+        state["store"] = _make_store(log)
+    if "refresher" not in state:
+        state["refresher"] = Debouncer(
+            delay=float(os.getenv("QUERY_HISTORY_REFRESH_DELAY", "2.0")),
+            logger=log,
+        )
+    if "client" not in state:
+        http = HTTPClientManager.from_settings(settings)
+        state["client"] = RSPClient(
+            anonymous_client=http.anonymous_client,
+            authed_client=http.authed_client,
+            logger=log,
+        )
+    if "templates" not in state:
+        state["templates"] = NotebookTemplates(state["client"], logger=log)
+    if "history" not in state:
+        state["history"] = QueryHistory(
+            state["client"], state["cache"], state["store"], logger=log
+        )
+    return state
+
+
+async def _close_query_state(settings: dict[str, Any]) -> None:
+    """Stop the background work of the query handlers, if they have
+    started any.  This must happen before the HTTP clients are closed.
+    """
+    state = settings.get("query", {})
+    if (refresher := state.get("refresher")) is not None:
+        await refresher.aclose()
+    if (history := state.get("history")) is not None:
+        await history.aclose()
+    if (client := state.get("client")) is not None:
+        await client.aclose()
 
 
 class QueryHandler(APIHandler):
@@ -27,14 +120,12 @@ class QueryHandler(APIHandler):
         """Get a client to talk to Times Square and TAP APIs."""
         super().initialize()
         self._home_dir = Path(os.getenv("HOME", ""))
-        if "query" not in self.settings:
-            self.settings["query"] = {}
-        if "cache" not in self.settings["query"]:
-            self.settings["query"]["cache"] = {}
-        if "client" not in self.settings["query"]:
-            self.settings["query"]["client"] = RSPClient(logger=self.log)
-        self._rsp_client = self.settings["query"]["client"]
-        self._cache = self.settings["query"]["cache"]
+        state = _get_query_state(self.settings, self.log)
+        self._rsp_client: RSPClient = state["client"]
+        self._cache: LRUCache = state["cache"]
+        self._refresher: Debouncer = state["refresher"]
+        self._history: QueryHistory = state["history"]
+        self._templates: NotebookTemplates = state["templates"]
 
     @tornado.web.authenticated
     async def post(self, *args: str, **kwargs: str) -> None:
@@ -56,24 +147,78 @@ class QueryHandler(APIHandler):
         changes made.  Otherwise we will write a file with the query
         template resolved, so the user can run it to retrieve results.
 
+        Instead of "value", the object may contain "values", a list of
+        values of the same type.  These are all resolved and written
+        concurrently, at most $QUERY_OPEN_CONCURRENCY (default 8) at a
+        time, and the response is a list with one entry per value,
+        in the same order: the single-query response with "value" added,
+        or, if that value failed, "value", "status" and "error".
         """
         input_str = self.request.body.decode("utf-8")
         input_document = json.loads(input_str)
         q_type = input_document["type"]
+        if "values" in input_document:
+            q_values = input_document["values"]
+            if not isinstance(q_values, list) or not all(
+                isinstance(v, str) for v in q_values
+            ):
+                raise tornado.web.HTTPError(
+                    400, reason="'values' must be a list of strings"
+                )
+            results = await self._create_queries(q_values, q_type)
+            self.set_header("Content-Type", "application/json")
+            self.write(json.dumps(results))
+            return
         q_value = input_document["value"]
         q_fn = await self._create_query(q_value, q_type)
         self.write(q_fn)
 
-    async def _create_query(self, q_value: str, q_type: str) -> str:
+    async def _create_queries(
+        self, q_values: list[str], q_type: str
+    ) -> list[dict[str, Any]]:
+        """Create several queries at once, with a single history refresh."""
+        semaphore = asyncio.Semaphore(
+            int(os.getenv("QUERY_OPEN_CONCURRENCY", "8"))
+        )
+
+        async def create(q_value: str) -> str:
+            async with semaphore:
+                return await self._create_query(q_value, q_type, refresh=False)
+
+        outcomes = await asyncio.gather(
+            *(create(v) for v in q_values), return_exceptions=True
+        )
+        results: list[dict[str, Any]] = []
+        for q_value, outcome in zip(q_values, outcomes, strict=True):
+            if isinstance(outcome, str):
+                results.append({"value": q_value, **json.loads(outcome)})
+                continue
+            if not isinstance(outcome, Exception):
+                raise outcome
+            self.log.warning(f"Cannot open query {q_value}: {outcome!s}")
+            status = 500
+            if isinstance(outcome, tornado.web.HTTPError):
+                status = outcome.status_code
+            results.append(
+                {"value": q_value, "status": status, "error": str(outcome)}
+            )
+        self._schedule_history_refresh()  # Opportunistic
+        return results
+
+    async def _create_query(
+        self, q_value: str, q_type: str, *, refresh: bool = True
+    ) -> str:
         match q_type:
             case "tap":
-                return await self._create_tap_query(q_value)
+                return await self._create_tap_query(q_value, refresh=refresh)
             case _:
                 raise UnsupportedQueryTypeError(
                     f"{q_type} is not a supported query type"
                 )
 
-    async def _create_tap_query(self, q_value: str) -> str:
+    async def _create_tap_query(
+        self, q_value: str, *, refresh: bool = True
+    ) -> str:
         # The value should be a URL or a jobref ID
         # A jobref ID is always 16 alphanumeric characters, or, optionally,
         # a dataset name followed by a colon followed by 16 alphanumeric
@@ -111,14 +256,18 @@ class QueryHandler(APIHandler):
         fname = (
             self._home_dir / "notebooks" / "queries" / f"{q_ds}_{q_id}.ipynb"
         )
-        if fname.is_file():
+        existing = await asyncio.to_thread(_read_text_or_none, fname)
+        if existing is not None:
             self.log.debug(f"File {fname!s} already exists.")
-            nb = fname.read_text()
+            nb = existing
         else:
             nb = await self._get_tap_query_notebook(url)
-        await self.refresh_query_history()  # Opportunistic
+        if refresh:
+            self._schedule_history_refresh()  # Opportunistic
         self.log.debug(f"Creating file {fname!s}")
-        return _write_notebook_response(nb, fname)
+        return await _write_notebook_response(
+            nb, fname, existing, body=self._notebook_body()
+        )
 
     async def _get_ts_query_notebook(
         self,
@@ -128,33 +277,11 @@ class QueryHandler(APIHandler):
         notebook: str,
         params: dict[str, str],
     ) -> str:
-        """Ask times-square for a rendered notebook."""
-        path = f"api/v1/github/rendered/{org}/{repo}/{directory}/{notebook}"
-        ts_url = await self._rsp_client.get_times_square_url() or ""
-        rendered_url = urljoin(ts_url, path)
-        self.log.debug(
-            f"Requesting rendered notebook from {rendered_url}"
-            f" with params: {params}"
+        """Render a Times Square notebook, locally if we can."""
+        return await self._templates.render(
+            org, repo, directory, notebook, params
         )
 
-        # Retrieve that URL and return the textual response, which is the
-        # string representing the rendered notebook "in unicode", which
-        # means "a string represented in the default encoding".
-        #
-        # We do a little sanity check: if what we get back isn't JSON, it
-        # definitely isn't a notebook, and we shouldn't write it to the
-        # user's space.
-        resp = await self._rsp_client.authed_client.get(
-            rendered_url, params=params
-        )
-        self.log.debug(f"GET {resp.url} -> status code {resp.status_code}")
-        try:
-            _ = json.loads(resp.text)
-        except Exception:
-            self.log.warning("Response text is not valid JSON")
-            raise NotANotebookError(resp.url) from None
-        return resp.text
-
     async def _get_nublado_seeds_notebook(
         self, notebook: str, params: dict[str, str]
     ) -> str:
@@ -190,9 +317,14 @@ class QueryHandler(APIHandler):
         # GET .../<qtype>/<id> will act as if we'd posted a query with
         #     qytpe and id; id should be in the form dataset:query_id
         # GET .../<qtype>/history/<n> will request the last n queries of
-        #     that type for each dataset.
+        #     that type for each dataset.  Send "Accept: application/x-ndjson"
+        #     to get one line per dataset, as each becomes available.
+        #     Add "?deadline=<seconds>" to bound the wait (default
+        #     $QUERY_HISTORY_DEADLINE, 5; 0 waits as long as it takes).
         # GET .../<qtype>/notebooks/query_all will create and open a notebook
         #     that will ask for all queries and yield their jobids.
+        # GET .../<qtype>/cache/stats will return the query text cache
+        #     counters.
 
         path = self.request.path
         stem = "/rubin/queries"
@@ -218,6 +350,9 @@ class QueryHandler(APIHandler):
                 )
 
     async def _tap_route_get(self, components: list[str]) -> None:
+        if components == ["cache", "stats"]:
+            self.write(self._cache.stats().model_dump_json())
+            return
         if components[0] == "history":
             if len(components) == 1:
                 self.write(await self._generate_query_all_notebook())
@@ -229,23 +364,30 @@ class QueryHandler(APIHandler):
                 raise UnimplementedQueryResolutionError(
                     f"{self.request.path} -> {exc!s}"
                 ) from exc
-            retries = 0
-            while True:
-                try:
-                    jobs = await self._rsp_client.get_query_history(count)
-                    break
-                except ReadTimeout:
-                    if retries < 3:
-                        retries += 1
-                    else:
-                        # Failed three times.  Give up.
-                        self.write(json.dumps({}))
-                        return
-            qdict = await self._get_query_text_list(jobs)
-            # This is a change from previous versions: we return a dict of
-            # dataset-name to query-history-list for that dataset
-            q_list = {x: [y.model_dump() for y in qdict[x]] for x in qdict}
-            self.write(json.dumps(q_list))
+            if "application/x-ndjson" in self.request.headers.get(
+                "Accept", ""
+            ):
+                await self._stream_query_history(count)
+                return
+            # Retries, and giving up on failing TAP services, happen per
+            # endpoint inside the client; whatever datasets did answer are
+            # returned, along with the status of each.  If the TAP services
+            # are too slow, we answer with the last history we had.
+            s_deadline = self.get_query_argument(
+                "deadline", os.getenv("QUERY_HISTORY_DEADLINE", "5.0")
+            )
+            try:
+                deadline = float(s_deadline)
+            except ValueError:
+                raise tornado.web.HTTPError(
+                    400, f"Invalid deadline {s_deadline}"
+                ) from None
+            response = await self._history.get_history(
+                count, deadline if deadline > 0 else None
+            )
+            self.log.info(f"Query text cache: {self._cache.stats()}")
+            self.write(response.model_dump_json())
+            return
         if len(components) == 1 and components[0] != "history":
             query_id = components[0]
             q_fn = await self._create_query(query_id, "tap")
@@ -255,21 +397,43 @@ class QueryHandler(APIHandler):
             self.write(await self._generate_query_all_notebook())
             return
 
-    async def refresh_query_history(self, count: int = 5) -> None:
-        """Get_query_history, but throw away the results.
+    async def _stream_query_history(self, count: int) -> None:
+        """Write the query history as newline-delimited JSON.
 
-        The motivation here is that if we are asked to do anything at all,
-        if it is an operation that returns a notebook, that's going to shift
-        the user's attention anyway, so we might as well get our data fresh
-        in hopes of speeding up the next time they actually want to look at
-        recent query history.
+        Each line is a `DatasetHistory`, written as soon as that dataset's
+        TAP service has answered and its query text has been found, so
+        fast datasets are not held up by slow ones.
         """
+        self.set_header("Content-Type", "application/x-ndjson")
+
+        async def emit(
+            dataset: str, jobs: list[dict[str, str]], status: DatasetStatus
+        ) -> None:
+            history = await self._history.get_query_text_list({dataset: jobs})
+            record = DatasetHistory(
+                dataset=dataset,
+                queries=history.get(dataset, []),
+                **status.model_dump(),
+            )
+            self.write(record.model_dump_json() + "\n")
+            await self.flush()
+
         try:
-            jobs = await self._rsp_client.get_query_history(count)
-            await self._get_query_text_list(jobs)
-        except ReadTimeout:
-            # get_query_history can be weirdly slow
-            pass
+            async with asyncio.TaskGroup() as tg:
+                async for item in self._rsp_client.iter_query_history(count):
+                    tg.create_task(emit(*item))
+        except* tornado.iostream.StreamClosedError:
+            self.log.debug("Query history stream closed by client")
+
+    def _schedule_history_refresh(self) -> None:
+        """Refresh the query history in the background.
+
+        Nothing waits for the refresh, and refreshes triggered within
+        $QUERY_HISTORY_REFRESH_DELAY seconds (default 2) of each other are
+        collapsed into one.  The shared history service does the work, so
+        the scheduled refresh does not keep this handler alive.
+        """
+        self._refresher.schedule(self._history.refresh)
 
     async def _generate_query_all_notebook(self) -> str:
         output = await self._get_query_all_notebook()
@@ -279,67 +443,63 @@ class QueryHandler(APIHandler):
             / "queries"
             / "tap_query_history.ipynb"
         )
-        await self.refresh_query_history()  # Opportunistic
-        return _write_notebook_response(output, fname)
+        self._schedule_history_refresh()  # Opportunistic
+        return await _write_notebook_response(
+            output, fname, body=self._notebook_body()
+        )
 
-    async def _get_query_text_list(
-        self, job_ids: dict[str, list[dict[str, str]]]
-    ) -> dict[str, list[TAPQuery]]:
-        """For each job ID, get the query text.  This will be returned
-        to the UI to be used as a hover tooltip.
+    def _notebook_body(self) -> NotebookBody:
+        """Return how much of a written notebook the client wants back.
 
-        Each time through, we both get results we already have for the
-        cache, and update the cache if we get new results.
+        This is the ``body`` query argument: ``full`` (the default) for the
+        notebook text, ``hash`` for its SHA-256 hash, or ``none``.
         """
-        retval: dict[str, list[TAPQuery]] = {}
-        self.log.info(f"Requesting query history for {job_ids}")
-        for dataset, jobs in job_ids.items():
-            for job in jobs:
-                try:
-                    qtext: TAPQuery | None = None
-                    jobkey = ""
-                    jobkey = f"{dataset}:{job['@id']}"
-                    qtext = await self._get_query_text_job(jobkey)
-                except Exception:
-                    if jobkey:
-                        self.log.exception(
-                            f"job {jobkey} text retrieval failed"
-                        )
-                    else:
-                        self.log.exception(
-                            "text retrieval failed for unknown job"
-                        )
-                if dataset not in retval and qtext:
-                    retval[dataset] = []
-                if qtext:
-                    retval[dataset].append(qtext)
-        return retval
-
-    async def _get_query_text_job(self, job: str) -> TAPQuery:
-        if job in self._cache:
-            return TAPQuery(jobref=job, text=self._cache[job])
-        jobref = await self._rsp_client.resolve_jobref_id(job)
-        self.log.debug(f"{job} -> {jobref}")
-        resp = await self._rsp_client.authed_client.get(
-            f"{jobref.endpoint}/async/{jobref.jobref_id}"
-        )
-        resp.raise_for_status()
-        # If we didn't get a 200, resp.text probably won't parse, and
-        # we will raise that.
-        #
-        # This could be done with pyvo, but it's really not any easier,
-        # because you still have to step through each parameter.
-        obj = xmltodict.parse(resp.text)
+        value = self.get_query_argument("body", NotebookBody.FULL)
+        try:
+            return NotebookBody(value)
+        except ValueError:
+            raise tornado.web.HTTPError(
+                400, f"Unknown body mode {value}"
+            ) from None
+
+
+class QueryEventsHandler(APIHandler):
+    """Push TAP query history changes to the frontend.
+
+    This is a server-sent events stream: each event is a JSON-serialized
+    `QueryHistoryEvent`.  Comment lines are sent every
+    $QUERY_EVENTS_KEEPALIVE seconds (default 15) so that proxies do not
+    close an idle connection, and so that we notice when the client has
+    gone away.
+    """
+
+    def initialize(self) -> None:
+        """Find the shared query history."""
+        super().initialize()
+        state = _get_query_state(self.settings, self.log)
+        self._history: QueryHistory = state["history"]
+        self._closed = asyncio.Event()
+
+    def on_connection_close(self) -> None:
+        self._closed.set()
+
+    @tornado.web.authenticated
+    async def get(self) -> None:
+        self.set_header("Content-Type", "text/event-stream")
+        self.set_header("Cache-Control", "no-cache")
+        keepalive = float(os.getenv("QUERY_EVENTS_KEEPALIVE", "15.0"))
+        queue = self._history.subscribe()
         try:
-            parms = obj["uws:job"]["uws:parameters"]["uws:parameter"]
-        except KeyError:
-            parms = []
-        for parm in parms:
-            if "@id" in parm and parm["@id"] == "QUERY":
-                qtext = parm.get("#text", None)
-                if qtext:
-                    tq = TAPQuery(jobref=job, text=qtext)
-                    self.log.debug(f"{job} -> '{qtext}'")
-                    self._cache.update({job: qtext})
-                    return tq
-        raise RuntimeError(f"Job {job} did not have associated query text")
+            while not self._closed.is_set():
+                try:
+                    async with asyncio.timeout(keepalive):
+                        event = await queue.get()
+                except TimeoutError:
+                    self.write(": keepalive\n\n")
+                else:
+                    self.write(f"data: {event.model_dump_json()}\n\n")
+                await self.flush()
+        except tornado.iostream.StreamClosedError:
+            self.log.debug("Query history event stream closed")
+        finally:
+            self._history.unsubscribe(queue)
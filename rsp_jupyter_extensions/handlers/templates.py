@@ -0,0 +1,374 @@
+"""Local rendering of Times Square notebook templates."""
+
+import asyncio
+import json
+import logging
+import os
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any
+from urllib.parse import urljoin
+
+import jinja2
+import nbformat
+from httpx import URL
+
+from ..models.query import NotANotebookError
+from .cache import ConditionalCache
+from .clients import RSPClient
+
+NBFORMAT_VERSION = 4
+
+type TemplateKey = tuple[str, str, str, str]
+type RenderKey = tuple[str, str, str, str, tuple[tuple[str, str], ...]]
+
+
+class _CannotRenderError(Exception):
+    """The template uses something we do not render locally."""
+
+
+def _parameters_cell(values: dict[str, Any]) -> str:
+    """Return the code that sets each parameter, as Times Square writes it
+    in place of a notebook's first code cell.
+    """
+    lines = [f"{name} = {values[name]!r}" for name in sorted(values)]
+    return "\n".join(["# Parameters", *lines])
+
+
+def _normalize(text: str) -> Any:
+    """Parse a notebook, joining cell sources split into lines, so that
+    notebooks can be compared regardless of how they were serialized.
+    """
+    nb = json.loads(text)
+    for cell in nb.get("cells", []):
+        if isinstance(cell.get("source"), list):
+            cell["source"] = "".join(cell["source"])
+    return nb
+
+
+def _same_notebook(a: str, b: str) -> bool:
+    """Whether two serialized notebooks have the same content."""
+    try:
+        return _normalize(a) == _normalize(b)
+    except (ValueError, AttributeError, TypeError):
+        return False
+
+
+@dataclass
+class _Template:
+    """An unrendered notebook, with each cell compiled as a template.
+
+    The first code cell is not compiled (its entry is `None`), since
+    Times Square replaces it with the parameter settings.
+    """
+
+    source: str
+    cells: list[jinja2.Template | None]
+    defaults: dict[str, Any]
+
+    def render(self, params: dict[str, str]) -> str:
+        """Render the notebook the way Times Square does.
+
+        Each cell is rendered with the parameter values as ``params``,
+        except the first code cell, which is replaced with code setting
+        each parameter; the ``times-square`` notebook metadata is removed.
+        """
+        unknown = set(params) - set(self.defaults)
+        if unknown:
+            raise _CannotRenderError(f"Unknown parameters {sorted(unknown)}")
+        values = {**self.defaults, **params}
+        nb = nbformat.reads(self.source, NBFORMAT_VERSION)
+        try:
+            for cell, template in zip(nb.cells, self.cells, strict=True):
+                if template is None:
+                    cell.source = _parameters_cell(values)
+                else:
+                    cell.source = template.render(params=values)
+        except jinja2.TemplateError as exc:
+            raise _CannotRenderError(str(exc)) from exc
+        nb.metadata.pop("times-square", None)
+        return nbformat.writes(nb)
+
+
+def _compile(page: dict[str, Any], source: str) -> _Template:
+    """Compile a Times Square page source notebook.
+
+    Raises
+    ------
+    _CannotRenderError
+        Raised if the notebook, or its parameters, are not something we
+        know how to render.
+    """
+    defaults: dict[str, Any] = {}
+    for name, schema in (page.get("parameters") or {}).items():
+        # Times Square converts the string values it is given to the type
+        # in the parameter schema.  We only pass strings through as-is.
+        if schema.get("type", "string") != "string":
+            raise _CannotRenderError(f"Parameter {name} is not a string")
+        defaults[name] = schema.get("default")
+    # These are notebooks, not HTML, so there is nothing to escape.
+    env = jinja2.Environment(
+        autoescape=False,  # noqa: S701
+        undefined=jinja2.StrictUndefined,
+    )
+    try:
+        nb = nbformat.reads(source, NBFORMAT_VERSION)
+        cells: list[jinja2.Template | None] = []
+        for cell in nb.cells:
+            if cell.cell_type == "code" and None not in cells:
+                cells.append(None)
+            else:
+                cells.append(env.from_string(cell.source))
+    except jinja2.TemplateError as exc:
+        raise _CannotRenderError(str(exc)) from exc
+    except Exception as exc:
+        raise _CannotRenderError(f"Not a notebook: {exc!s}") from exc
+    return _Template(source=source, cells=cells, defaults=defaults)
+
+
+@dataclass
+class _Page:
+    """What Times Square told us about a page, and when."""
+
+    metadata: dict[str, Any]
+    source: str
+    template: _Template | None
+    fetched_at: float
+    # Whether our rendering of this page has been found to match Times
+    # Square's; `None` until it has been checked.
+    verified: bool | None = None
+
+
+class NotebookTemplates:
+    """Render Times Square notebooks, locally where we can.
+
+    The unrendered notebook for each page is fetched from Times Square
+    and rendered here the way Times Square does it: with Jinja, with the
+    page parameters available as ``params``, the first code cell replaced
+    by the parameter settings, and the ``times-square`` metadata removed.
+    Pages we cannot render (non-string parameters, or templates that need
+    anything other than ``params``) are rendered by Times Square instead.
+
+    Since Times Square is the authority on rendering, the first local
+    rendering of each version of a page is checked against Times Square's
+    rendering of the same parameters.  Only if they match is that page
+    rendered locally from then on; otherwise Times Square keeps rendering
+    it.
+
+    Rendered notebooks are cached by page and parameters for ``ttl``
+    seconds.  After that, the page is revalidated with conditional requests
+    to Times Square, and if its metadata or source has changed, every
+    cached rendering of it is dropped.
+
+    Parameters
+    ----------
+    rsp_client
+        Client used to find and talk to Times Square.
+    logger
+        Logger to use (optional, created if not specified)
+    ttl
+        Seconds a page or rendering is used before being revalidated
+        (optional, taken from $QUERY_NOTEBOOK_CACHE_TTL if not specified,
+        default 300.0)
+    max_entries
+        Maximum number of rendered notebooks to keep.
+    """
+
+    def __init__(
+        self,
+        rsp_client: RSPClient,
+        logger: logging.Logger | None = None,
+        *,
+        ttl: float | None = None,
+        max_entries: int = 128,
+    ) -> None:
+        self._rsp_client = rsp_client
+        self._logger = logger or logging.getLogger(__name__)
+        if ttl is None:
+            ttl = float(os.getenv("QUERY_NOTEBOOK_CACHE_TTL", "300.0"))
+        self._ttl = ttl
+        self._max_entries = max_entries
+        self._pages: dict[TemplateKey, _Page] = {}
+        self._fetches: dict[TemplateKey, asyncio.Task[_Page]] = {}
+        self._rendered: OrderedDict[RenderKey, tuple[float, str]] = (
+            OrderedDict()
+        )
+        self._responses: ConditionalCache[str] = ConditionalCache()
+
+    async def render(
+        self,
+        org: str,
+        repo: str,
+        directory: str,
+        notebook: str,
+        params: dict[str, str],
+    ) -> str:
+        """Return the notebook rendered with ``params``.
+
+        Raises
+        ------
+        NotANotebookError
+            Raised if Times Square did not return a notebook.
+        """
+        key = (org, repo, directory, notebook)
+        rkey = (*key, tuple(sorted(params.items())))
+        if (cached := self._rendered.get(rkey)) is not None:
+            rendered_at, cached_text = cached
+            if time.monotonic() - rendered_at < self._ttl:
+                self._rendered.move_to_end(rkey)
+                self._logger.debug(f"Using cached {'/'.join(key)}")
+                return cached_text
+        page = await self._get_page(key)
+        text: str | None = None
+        if (
+            page is not None
+            and page.template is not None
+            and page.verified is not False
+        ):
+            try:
+                text = page.template.render(params)
+            except _CannotRenderError as exc:
+                self._logger.debug(
+                    f"Cannot render {'/'.join(key)} locally: {exc!s}"
+                )
+            if text is not None and page.verified is None:
+                remote = await self.render_remote(key, params)
+                page.verified = _same_notebook(text, remote)
+                if not page.verified:
+                    self._logger.warning(
+                        f"Local rendering of {'/'.join(key)} differs from"
+                        " Times Square's; leaving it to Times Square"
+                    )
+                text = remote
+        if text is None:
+            text = await self.render_remote(key, params)
+        self._rendered[rkey] = (time.monotonic(), text)
+        self._rendered.move_to_end(rkey)
+        while len(self._rendered) > self._max_entries:
+            self._rendered.popitem(last=False)
+        return text
+
+    async def render_remote(
+        self, key: TemplateKey, params: dict[str, str]
+    ) -> str:
+        """Ask Times Square for a rendered notebook.
+
+        A rendering we already hold is revalidated with a conditional
+        request, and reused if Times Square says it has not changed.
+
+        Raises
+        ------
+        NotANotebookError
+            Raised if Times Square did not return a notebook.
+        """
+        path = f"api/v1/github/rendered/{'/'.join(key)}"
+        ts_url = await self._rsp_client.get_times_square_url() or ""
+        rendered_url = urljoin(ts_url, path)
+        self._logger.debug(
+            f"Requesting rendered notebook from {rendered_url}"
+            f" with params: {params}"
+        )
+
+        # Retrieve that URL and return the textual response, which is the
+        # string representing the rendered notebook "in unicode", which
+        # means "a string represented in the default encoding".
+        #
+        # We do a little sanity check: if what we get back isn't JSON, it
+        # definitely isn't a notebook, and we shouldn't write it to the
+        # user's space.
+        cache_key = str(URL(rendered_url, params=params))
+        resp = await self._rsp_client.authed_client.get(
+            rendered_url,
+            params=params,
+            headers=self._responses.headers(cache_key),
+        )
+        self._logger.debug(f"GET {resp.url} -> status code {resp.status_code}")
+        if resp.status_code == 304:
+            if (text := self._responses.get(cache_key)) is not None:
+                return text
+            # Evicted since we asked.
+            resp = await self._rsp_client.authed_client.get(
+                rendered_url, params=params
+            )
+        try:
+            _ = json.loads(resp.text)
+        except Exception:
+            self._logger.warning("Response text is not valid JSON")
+            raise NotANotebookError(resp.url) from None
+        self._responses.put(cache_key, resp.headers, resp.text)
+        return resp.text
+
+    async def _get_page(self, key: TemplateKey) -> _Page | None:
+        page = self._pages.get(key)
+        if page is not None and time.monotonic() - page.fetched_at < self._ttl:
+            return page
+        task = self._fetches.get(key)
+        if task is None:
+            task = asyncio.create_task(self._fetch_page(key, page))
+            self._fetches[key] = task
+            task.add_done_callback(lambda t: self._finish_fetch(key, t))
+        try:
+            # Shielded, so that one caller giving up does not cancel the
+            # fetch for everyone else.
+            return await asyncio.shield(task)
+        except Exception as exc:
+            # Keep using what we had, if anything, and try again next time.
+            self._logger.warning(
+                f"Cannot fetch template {'/'.join(key)}: {exc!s}"
+            )
+            return page
+
+    def _finish_fetch(
+        self, key: TemplateKey, task: asyncio.Task[_Page]
+    ) -> None:
+        if self._fetches.get(key) is task:
+            del self._fetches[key]
+
+    async def _fetch_page(
+        self, key: TemplateKey, previous: _Page | None
+    ) -> _Page:
+        ts_url = await self._rsp_client.get_times_square_url() or ""
+        page_url = urljoin(ts_url, f"api/v1/github/{'/'.join(key)}")
+        metadata = json.loads(await self._get_conditional(page_url))
+        source = await self._get_conditional(metadata["source_url"])
+        now = time.monotonic()
+        if (
+            previous is not None
+            and previous.metadata == metadata
+            and previous.source == source
+        ):
+            previous.fetched_at = now
+            return previous
+        if previous is not None:
+            self._logger.info(f"Template {'/'.join(key)} has changed")
+        self._discard_rendered(key)
+        try:
+            template = _compile(metadata, source)
+            self._logger.debug(f"Cached template for {'/'.join(key)}")
+        except _CannotRenderError as exc:
+            self._logger.info(
+                f"Rendering {'/'.join(key)} with Times Square: {exc!s}"
+            )
+            template = None
+        page = _Page(
+            metadata=metadata, source=source, template=template, fetched_at=now
+        )
+        self._pages[key] = page
+        return page
+
+    async def _get_conditional(self, url: str) -> str:
+        client = self._rsp_client.authed_client
+        resp = await client.get(url, headers=self._responses.headers(url))
+        if resp.status_code == 304:
+            if (text := self._responses.get(url)) is not None:
+                return text
+            # Evicted since we asked.
+            resp = await client.get(url)
+        resp.raise_for_status()
+        self._responses.put(url, resp.headers, resp.text)
+        return resp.text
+
+    def _discard_rendered(self, key: TemplateKey) -> None:
+        for rkey in [k for k in self._rendered if k[:4] == key]:
+            del self._rendered[rkey]
@@ -14,8 +14,8 @@ from tempfile import TemporaryDirectory
 from typing import Any
 from urllib.parse import urlparse, urlunparse
 
-import requests
 import tornado
+from httpx import Client
 from jupyter_server.base.handlers import APIHandler
 
 from ..models.tutorials import (
@@ -28,6 +28,7 @@ from ..models.tutorials import (
     UserEnvironmentError,
 )
 from ._utils import _get_homedir, _get_jupyter_server_root
+from .httpclients import HTTPClientManager
 
 
 def _find_repo() -> str | None:
@@ -92,7 +93,15 @@ def _reabsolutize_path(path: Path) -> Path:
     return root_dir / path
 
 
-def _copy_content(entry: HierarchyEntry, dest: Path) -> None:
+def _fetch_content(client: Client, src: str, dest: Path) -> None:
+    with client.stream("GET", src) as resp, dest.open("wb") as fd:
+        for chunk in resp.iter_bytes(chunk_size=int(1e6)):
+            fd.write(chunk)
+
+
+def _copy_content(
+    entry: HierarchyEntry, dest: Path, client: Client | None = None
+) -> None:
     # Note that we assume we've already decided we want to do this (that is,
     # the check for Disposition and a file conflict has already happened).
     #
@@ -107,16 +116,19 @@ def _copy_content(entry: HierarchyEntry, dest: Path) -> None:
     # Note that because of the above, entry.dest has different meanings
     # depending on the setting; rather than recalculating, we just pass
     # the updated path from the caller.
+    #
+    # Fetches use the shared, pooled client if we were given one.
     dest.parent.mkdir(exist_ok=True, parents=True)
     if entry.action == Actions.FETCH:
         if not isinstance(entry.src, str):
             # The typing should already be correct because of our model
             # validation, but mypy needs some convincing.
             entry.src = str(entry.src)
-        resp = requests.get(entry.src, stream=True, timeout=30)
-        with dest.open("wb") as fd:
-            for chunk in resp.iter_content(chunk_size=int(1e6)):
-                fd.write(chunk)
+        if client is None:
+            with Client(follow_redirects=True, timeout=30) as one_off:
+                _fetch_content(one_off, entry.src, dest)
+        else:
+            _fetch_content(client, entry.src, dest)
     else:
         if not isinstance(entry.src, Path):
             # Same story on the typing.
@@ -141,7 +153,9 @@ def _get_notebook_path(dest: Path) -> str:
     return str(abs_dest.relative_to(root_dir))
 
 
-def _copy_and_guide(input_document: dict[str, Any]) -> _UIGuidance:
+def _copy_and_guide(
+    input_document: dict[str, Any], client: Client | None = None
+) -> _UIGuidance:
     entry = HierarchyEntry.from_primitive(input_document)
     # For this extension, the target should always be inside the user's
     # home directory.  This is a consequence of the RSP design, where
@@ -167,7 +181,7 @@ def _copy_and_guide(input_document: dict[str, Any]) -> _UIGuidance:
         else:
             # Otherwise, just fall through and overwrite the file.
             pass
-    _copy_content(entry, dest)  # Dest path may have changed.
+    _copy_content(entry, dest, client)  # Dest path may have changed.
     # We don't want to issue the redirect, because we don't want to
     # mess with opening a new window in the JupyterLab API.  Instead,
     # we should just return a 200 with the destination field filled
@@ -264,7 +278,8 @@ class TutorialsMenuHandler(APIHandler):
         self.log.info("Received POST request for tutorial copy")
         input_str = self.request.body.decode("utf-8")
         input_document = json.loads(input_str)
-        guide = _copy_and_guide(input_document)
+        client = HTTPClientManager.from_settings(self.settings).sync_client
+        guide = _copy_and_guide(input_document, client)
         self.log.debug(f"Copy/guide got: {guide}")
         if guide.dest is None:
             dest = input_document["dest"]
@@ -0,0 +1,36 @@
+"""Models for cached service discovery information."""
+
+from __future__ import annotations
+
+from typing import Annotated
+
+from pydantic import BaseModel, Field
+
+
+class DiscoverySnapshot(BaseModel):
+    """The discovery answers the extension needs, as of a single moment.
+
+    This is what we keep in memory and on disk so that a freshly-started
+    lab can answer discovery questions before Repertoire has replied.
+    """
+
+    base_url: Annotated[
+        str | None, Field(title="Repertoire URL the snapshot came from")
+    ] = None
+    fetched_at: Annotated[
+        float, Field(title="When the snapshot was taken (seconds since epoch)")
+    ] = 0.0
+    datasets: Annotated[list[str], Field(title="Datasets in this RSP")] = []
+    tap_urls: Annotated[
+        dict[str, str], Field(title="Map of dataset to TAP endpoint")
+    ] = {}
+    environment_name: Annotated[
+        str | None, Field(title="Name of the RSP environment")
+    ] = None
+    logout_url: Annotated[str | None, Field(title="Logout URL")] = None
+    landing_page_url: Annotated[
+        str | None, Field(title="Landing page URL")
+    ] = None
+    times_square_url: Annotated[
+        str | None, Field(title="Times Square API URL")
+    ] = None
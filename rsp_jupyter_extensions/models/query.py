@@ -2,6 +2,7 @@
 
 from __future__ import annotations
 
+from enum import StrEnum, auto
 from typing import Annotated
 
 from pydantic import BaseModel, Field
@@ -24,7 +25,106 @@ class NotANotebookError(Exception):
 
 
 class TAPQuery(BaseModel):
-    """TAP query mapping jobref ID to query text."""
+    """TAP query mapping jobref ID to query text, with what the UWS job
+    document said about the job.
+    """
 
     jobref: Annotated[str, Field(title="TAP jobref ID")]
     text: Annotated[str, Field(title="TAP query text")]
+    phase: Annotated[str | None, Field(title="UWS execution phase")] = None
+    creation_time: Annotated[str | None, Field(title="UWS creation time")] = (
+        None
+    )
+    start_time: Annotated[str | None, Field(title="UWS start time")] = None
+    end_time: Annotated[str | None, Field(title="UWS end time")] = None
+    execution_duration: Annotated[
+        int | None, Field(title="Maximum run time allowed, in seconds")
+    ] = None
+    row_count: Annotated[
+        int | None, Field(title="Number of result rows, if reported")
+    ] = None
+
+
+class CacheStats(BaseModel):
+    """Counters describing an in-memory cache."""
+
+    hits: Annotated[int, Field(title="Lookups answered from the cache")] = 0
+    misses: Annotated[int, Field(title="Lookups not in the cache")] = 0
+    evictions: Annotated[
+        int, Field(title="Entries evicted to stay within budget")
+    ] = 0
+    entries: Annotated[int, Field(title="Entries currently cached")] = 0
+    size: Annotated[int, Field(title="Bytes currently cached")] = 0
+    max_entries: Annotated[int, Field(title="Entry budget")] = 0
+    max_size: Annotated[int, Field(title="Byte budget")] = 0
+
+
+class QueryHistoryEvent(BaseModel):
+    """A new TAP job, or a change to a known one, in the query history."""
+
+    dataset: Annotated[str, Field(title="Dataset the job was run against")]
+    jobref: Annotated[str, Field(title="TAP jobref ID (dataset:id)")]
+    phase: Annotated[str | None, Field(title="UWS execution phase")] = None
+    creation_time: Annotated[str | None, Field(title="UWS creation time")] = (
+        None
+    )
+    text: Annotated[str | None, Field(title="TAP query text")] = None
+
+
+class HistoryStatus(StrEnum):
+    """How a dataset's query history request went."""
+
+    OK = auto()
+    FAILED = auto()
+    UNAVAILABLE = auto()
+
+
+class NotebookBody(StrEnum):
+    """How much of a written notebook to echo back to the client."""
+
+    FULL = auto()
+    """The whole notebook text."""
+
+    HASH = auto()
+    """Only the SHA-256 hash of the notebook text."""
+
+    NONE = auto()
+    """Nothing; the client only needs to know where the file is."""
+
+
+class DatasetStatus(BaseModel):
+    """Outcome of the query history request for one dataset."""
+
+    status: Annotated[HistoryStatus, Field(title="Outcome")]
+    detail: Annotated[
+        str | None, Field(title="What went wrong, if anything")
+    ] = None
+
+
+class QueryHistoryResponse(BaseModel):
+    """Query history for every dataset, with how each request went.
+
+    A dataset whose TAP service failed, or is being left alone after
+    repeated failures, has no history entry but does have a status.
+    """
+
+    history: Annotated[
+        dict[str, list[TAPQuery]],
+        Field(title="Newest queries for each dataset, newest first"),
+    ] = {}
+    status: Annotated[
+        dict[str, DatasetStatus], Field(title="Outcome for each dataset")
+    ] = {}
+    stale: Annotated[
+        bool,
+        Field(title="Whether this is an older history served instead"),
+    ] = False
+
+
+class DatasetHistory(DatasetStatus):
+    """Query history for one dataset, as sent in a streamed response."""
+
+    dataset: Annotated[str, Field(title="Dataset name")]
+    queries: Annotated[
+        list[TAPQuery], Field(title="Newest queries, newest first")
+    ] = []
@@ -0,0 +1,64 @@
+"""Test debounced background work."""
+
+import asyncio
+
+import pytest
+
+from rsp_jupyter_extensions.handlers._background import Debouncer
+
+
+@pytest.mark.asyncio
+async def test_debouncer() -> None:
+    """Triggers are coalesced, with one trailing run for triggers that
+    arrive while a run is in progress, and failures do not stop later runs.
+    """
+    runs = 0
+    started = asyncio.Event()
+    release = asyncio.Event()
+
+    async def work() -> None:
+        nonlocal runs
+        runs += 1
+        started.set()
+        await release.wait()
+
+    debouncer = Debouncer(delay=0.01)
+    for _ in range(5):
+        debouncer.schedule(work)
+    await started.wait()
+    assert runs == 1
+
+    # Triggered during the run: one more run once it finishes.
+    started.clear()
+    for _ in range(5):
+        debouncer.schedule(work)
+    release.set()
+    await started.wait()
+    await debouncer.wait()
+    assert runs == 2
+
+    async def fail() -> None:
+        raise RuntimeError("boom")
+
+    debouncer.schedule(fail)
+    await debouncer.wait()
+    debouncer.schedule(work)
+    await debouncer.wait()
+    assert runs == 3
+
+
+@pytest.mark.asyncio
+async def test_debouncer_close() -> None:
+    """Closing cancels a scheduled run before it starts."""
+    runs = 0
+
+    async def work() -> None:
+        nonlocal runs
+        runs += 1
+
+    debouncer = Debouncer(delay=0.05)
+    debouncer.schedule(work)
+    await debouncer.aclose()
+    await asyncio.sleep(0.1)
+    assert runs == 0
+    await debouncer.wait()
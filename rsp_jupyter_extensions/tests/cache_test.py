@@ -0,0 +1,88 @@
+"""Test the query extension caches."""
+
+from pathlib import Path
+
+from rsp_jupyter_extensions.handlers.cache import (
+    ConditionalCache,
+    LRUCache,
+    PersistentCache,
+)
+
+
+def test_persistent_cache(tmp_path: Path) -> None:
+    """Entries survive reopening, and the least recently used entries are
+    evicted once the cap is reached.
+    """
+    path = tmp_path / "cache" / "query_text.sqlite3"
+    cache = PersistentCache(path, max_entries=3)
+    assert cache.get("dp1:a") is None
+    for key in ("dp1:a", "dp1:b", "dp1:c"):
+        cache.put(key, f"SELECT '{key}'")
+    # Touch "a" so that "b" is the least recently used.
+    assert cache.get("dp1:a") == "SELECT 'dp1:a'"
+    cache.put("dp1:d", "SELECT 'dp1:d'")
+    assert len(cache) == 3
+    assert cache.get("dp1:b") is None
+    cache.close()
+
+    cache = PersistentCache(path, max_entries=3)
+    assert cache.get("dp1:a") == "SELECT 'dp1:a'"
+    assert cache.get("dp1:d") == "SELECT 'dp1:d'"
+    cache.close()
+
+
+def test_persistent_cache_unusable(tmp_path: Path) -> None:
+    """A cache that cannot be opened just stops caching."""
+    blocker = tmp_path / "not-a-directory"
+    blocker.write_text("")
+    cache = PersistentCache(blocker / "query_text.sqlite3")
+    cache.put("dp1:a", "SELECT 1")
+    assert cache.get("dp1:a") is None
+    assert len(cache) == 0
+
+
+def test_lru_cache() -> None:
+    """The in-memory cache stays within both budgets and counts its use."""
+    cache = LRUCache(max_entries=3, max_size=40)
+    assert cache.get("a") is None
+    cache.put("a", "1" * 9)
+    cache.put("b", "2" * 9)
+    cache.put("c", "3" * 9)
+    assert cache.get("a") == "1" * 9
+    # Over the entry budget: "b" is least recently used.
+    cache.put("d", "4" * 9)
+    assert "b" not in cache
+    # Over the byte budget: "c" and then "a" go.
+    cache.put("e", "5" * 20)
+    assert "c" not in cache
+    assert "a" not in cache
+    # Too big to cache at all.
+    cache.put("f", "6" * 40)
+    assert "f" not in cache
+
+    stats = cache.stats()
+    assert stats.hits == 1
+    assert stats.misses == 1
+    assert stats.evictions == 3
+    assert stats.entries == len(cache) == 2
+    assert stats.size == 10 + 21
+
+
+def test_conditional_cache() -> None:
+    """Validators become conditional request headers; responses without
+    validators are not kept.
+    """
+    cache: ConditionalCache[str] = ConditionalCache(max_entries=1)
+    cache.put("a", {"ETag": '"1"', "Last-Modified": "yesterday"}, "A")
+    assert cache.headers("a") == {
+        "If-None-Match": '"1"',
+        "If-Modified-Since": "yesterday",
+    }
+    assert cache.get("a") == "A"
+    cache.put("a", {}, "A2")
+    assert cache.headers("a") == {}
+    assert cache.get("a") is None
+    cache.put("b", {"ETag": '"2"'}, "B")
+    cache.put("c", {"ETag": '"3"'}, "C")
+    assert cache.get("b") is None
+    assert cache.get("c") == "C"
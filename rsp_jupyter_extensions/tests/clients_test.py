@@ -0,0 +1,489 @@
+"""Test the RSP discovery and TAP client."""
+
+import asyncio
+import json
+from pathlib import Path
+
+import httpx
+import pytest
+
+from rsp_jupyter_extensions.handlers.clients import JobRef
+from rsp_jupyter_extensions.models.query import (
+    HistoryStatus,
+    UnknownDatasetError,
+)
+
+from .conftest import (
+    BASE_URL,
+    REPERTOIRE_URL,
+    jobref_xml,
+    jobs_xml,
+    make_client,
+)
+
+
+@pytest.mark.asyncio
+async def test_query_history_concurrent() -> None:
+    """Endpoints are queried concurrently and slow ones are dropped."""
+    in_flight = 0
+    max_in_flight = 0
+
+    async def tap(request: httpx.Request) -> httpx.Response:
+        nonlocal in_flight, max_in_flight
+        in_flight += 1
+        max_in_flight = max(max_in_flight, in_flight)
+        try:
+            if request.url.path.startswith("/api/ssotap"):
+                await asyncio.sleep(5)
+            else:
+                await asyncio.sleep(0.05)
+        finally:
+            in_flight -= 1
+        return httpx.Response(
+            200,
+            text=jobs_xml(
+                jobref_xml("aaaaaaaaaaaaaaaa"),
+                jobref_xml(
+                    "bbbbbbbbbbbbbbbb",
+                    creation_time="2026-02-01T00:00:00.000Z",
+                ),
+            ),
+        )
+
+    client = make_client(tap, endpoint_timeout=0.5, max_retries=0)
+    history = await client.get_query_history(5)
+    assert "lsstcam" not in history
+    assert [j["@id"] for j in history["dp1"]] == [
+        "bbbbbbbbbbbbbbbb",
+        "aaaaaaaaaaaaaaaa",
+    ]
+    assert max_in_flight > 1
+
+
+@pytest.mark.asyncio
+async def test_query_history_retry_and_breaker() -> None:
+    """Transient failures are retried, and an endpoint that keeps failing
+    is left alone for a while, without losing the other datasets.
+    """
+    attempts = {"tap": 0, "ssotap": 0}
+
+    async def tap(request: httpx.Request) -> httpx.Response:
+        if request.url.path == "/api/tap/async":
+            attempts["tap"] += 1
+            if attempts["tap"] == 1:
+                return httpx.Response(503)
+            return httpx.Response(
+                200,
+                text=jobs_xml(jobref_xml("aaaaaaaaaaaaaaaa")),
+            )
+        attempts["ssotap"] += 1
+        return httpx.Response(502)
+
+    client = make_client(
+        tap,
+        max_retries=2,
+        retry_delay=0.01,
+        breaker_threshold=2,
+        breaker_cooldown=60.0,
+        history_ttl=0.0,
+    )
+    result = await client.fetch_query_history(5)
+    assert attempts == {"tap": 2, "ssotap": 3}
+    assert list(result.jobs) == ["dp02", "dp1"]
+    assert result.status["dp1"].status == HistoryStatus.OK
+    assert result.status["lsstcam"].status == HistoryStatus.FAILED
+    assert result.status["lsstcam"].detail == (
+        f"Status 502 from {BASE_URL}/api/ssotap/async"
+    )
+
+    await client.fetch_query_history(5)
+    assert attempts["ssotap"] == 6
+    result = await client.fetch_query_history(5)
+    assert attempts["ssotap"] == 6
+    assert result.status["lsstcam"].status == HistoryStatus.UNAVAILABLE
+    assert list(result.jobs) == ["dp02", "dp1"]
+
+
+@pytest.mark.asyncio
+async def test_breaker_trial_released() -> None:
+    """A trial call that fails unexpectedly counts as a failure, and only
+    affects that endpoint's datasets; a call abandoned because its consumer
+    went away is not counted at all.
+    """
+    mode = "fail"
+    jobs = jobs_xml(jobref_xml("aaaaaaaaaaaaaaaa"))
+
+    async def tap(request: httpx.Request) -> httpx.Response:
+        if request.url.path == "/api/tap/async":
+            return httpx.Response(200, text=jobs)
+        if request.url.path != "/api/ssotap/async":
+            return httpx.Response(404)
+        match mode:
+            case "fail":
+                return httpx.Response(503)
+            case "slow":
+                await asyncio.sleep(5)
+            case "boom":
+                raise RuntimeError("boom")
+        return httpx.Response(200, text=jobs)
+
+    client = make_client(
+        tap,
+        max_retries=0,
+        breaker_threshold=1,
+        breaker_cooldown=0.2,
+        history_ttl=0.0,
+    )
+
+    async def abandon() -> None:
+        stream = client.iter_query_history(5)
+        dataset, _, _ = await anext(stream)
+        assert dataset != "lsstcam"
+        await stream.aclose()
+        await asyncio.sleep(0.01)
+
+    history = await client.fetch_query_history(5)
+    assert history.status["lsstcam"].status == HistoryStatus.FAILED
+
+    # The consumer goes away during the trial call, so another trial is
+    # allowed straight away.
+    await asyncio.sleep(0.3)
+    mode = "slow"
+    await abandon()
+    mode = "boom"
+    history = await client.fetch_query_history(5)
+    assert history.status["lsstcam"].status == HistoryStatus.FAILED
+    assert history.status["lsstcam"].detail == "boom"
+    assert history.status["dp1"].status == HistoryStatus.OK
+    assert len(history.jobs["dp1"]) == 1
+
+    await asyncio.sleep(0.3)
+    mode = "ok"
+    history = await client.fetch_query_history(5)
+    assert history.status["lsstcam"].status == HistoryStatus.OK
+
+    # Consumers going away do not count against a healthy endpoint.
+    mode = "slow"
+    for _ in range(3):
+        await abandon()
+    mode = "ok"
+    history = await client.fetch_query_history(5)
+    assert history.status["lsstcam"].status == HistoryStatus.OK
+
+
+@pytest.mark.asyncio
+async def test_client_close() -> None:
+    """Closing the client stops the fetches it runs for its callers."""
+    started = asyncio.Event()
+    cancelled: list[str] = []
+
+    async def tap(request: httpx.Request) -> httpx.Response:
+        try:
+            started.set()
+            await asyncio.sleep(5)
+        except asyncio.CancelledError:
+            cancelled.append(request.url.path)
+            raise
+        return httpx.Response(404)
+
+    client = make_client(tap)
+    job = JobRef("dp1", "aaaaaaaaaaaaaaaa", f"{BASE_URL}/api/tap")
+    callers = [
+        asyncio.create_task(client.fetch_query_history(5)),
+        asyncio.create_task(client.get_job_document(job)),
+    ]
+    await asyncio.wait_for(started.wait(), timeout=2)
+    await asyncio.sleep(0.05)
+    await client.aclose()
+    assert "/api/tap/async/aaaaaaaaaaaaaaaa" in cancelled
+    assert "/api/ssotap/async" in cancelled
+    results = await asyncio.gather(*callers, return_exceptions=True)
+    assert all(isinstance(r, asyncio.CancelledError) for r in results)
+
+
+@pytest.mark.asyncio
+async def test_query_history_incremental() -> None:
+    """Once settled jobs are known, only newer jobs are asked for."""
+    jobs = [
+        ("aaaaaaaaaaaaaaaa", "2026-01-01T00:00:00.000Z"),
+        ("bbbbbbbbbbbbbbbb", "2026-02-01T00:00:00.000Z"),
+    ]
+    afters: list[str | None] = []
+
+    async def tap(request: httpx.Request) -> httpx.Response:
+        if request.url.path != "/api/ssotap/async":
+            return httpx.Response(404)
+        after = request.url.params.get("AFTER")
+        afters.append(after)
+        newer = [j for j in jobs if after is None or j[1] > after]
+        return httpx.Response(
+            200,
+            text=jobs_xml(
+                *(jobref_xml(j_id, creation_time=c) for j_id, c in newer)
+            ),
+        )
+
+    client = make_client(tap, max_retries=0, history_ttl=0.0)
+    await client.get_query_history(2)
+    assert afters == [None]
+
+    jobs.append(("cccccccccccccccc", "2026-03-01T00:00:00.000Z"))
+    history = await client.get_query_history(2)
+    assert afters == [None, "2026-02-01T00:00:00.000Z"]
+    assert [j["@id"] for j in history["lsstcam"]] == [
+        "cccccccccccccccc",
+        "bbbbbbbbbbbbbbbb",
+    ]
+
+    # Nothing new.
+    history = await client.get_query_history(1)
+    assert afters[-1] == "2026-03-01T00:00:00.000Z"
+    assert [j["@id"] for j in history["lsstcam"]] == ["cccccccccccccccc"]
+
+    # More than we hold means a full fetch.
+    await client.get_query_history(5)
+    assert afters[-1] is None
+
+
+@pytest.mark.asyncio
+async def test_conditional_requests() -> None:
+    """Job lists and job documents are revalidated, and reused on 304."""
+    bodies = 0
+
+    async def tap(request: httpx.Request) -> httpx.Response:
+        nonlocal bodies
+        path = request.url.path
+        if not path.startswith("/api/ssotap/async"):
+            return httpx.Response(404)
+        etag = f'"{path}"'
+        if request.headers.get("If-None-Match") == etag:
+            return httpx.Response(304, headers={"ETag": etag})
+        bodies += 1
+        if path == "/api/ssotap/async":
+            text = jobs_xml(jobref_xml("aaaaaaaaaaaaaaaa"))
+        else:
+            text = "<uws:job/>"
+        return httpx.Response(200, text=text, headers={"ETag": etag})
+
+    client = make_client(tap, history_ttl=0.0, full_refresh_interval=0.0)
+    first = await client.get_query_history(5)
+    second = await client.get_query_history(5)
+    assert bodies == 1
+    assert second == first
+
+    jobref = await client.resolve_jobref_id("lsstcam:aaaaaaaaaaaaaaaa")
+    assert await client.get_job_document(jobref) == "<uws:job/>"
+    assert await client.get_job_document(jobref) == "<uws:job/>"
+    assert bodies == 2
+
+
+@pytest.mark.asyncio
+async def test_shared_endpoint_fetched_once() -> None:
+    """Datasets sharing a TAP endpoint cause only one job list request."""
+    requested: list[str] = []
+
+    async def tap(request: httpx.Request) -> httpx.Response:
+        requested.append(request.url.path)
+        if request.url.path.endswith("/async"):
+            return httpx.Response(
+                200,
+                text=jobs_xml(jobref_xml("aaaaaaaaaaaaaaaa")),
+            )
+        if request.url.path == "/api/ssotap/async/cccccccccccccccc":
+            return httpx.Response(200, text="<uws:job/>")
+        return httpx.Response(404)
+
+    client = make_client(tap)
+    history = await client.get_query_history(5)
+    assert sorted(requested) == ["/api/ssotap/async", "/api/tap/async"]
+    assert list(history) == ["dp02", "dp1", "lsstcam"]
+    assert history["dp02"] == history["dp1"]
+
+    requested.clear()
+    jobref = await client.resolve_jobref_id("cccccccccccccccc")
+    assert jobref.dataset == "lsstcam"
+    assert requested.count("/api/tap/async/cccccccccccccccc") == 1
+
+
+@pytest.mark.asyncio
+async def test_resolve_races_endpoints() -> None:
+    """The fastest endpoint to find a jobref wins; the others are
+    cancelled.
+    """
+    cancelled = False
+
+    async def tap(request: httpx.Request) -> httpx.Response:
+        nonlocal cancelled
+        if request.url.path.startswith("/api/tap/"):
+            try:
+                await asyncio.sleep(5)
+            except asyncio.CancelledError:
+                cancelled = True
+                raise
+            return httpx.Response(404)
+        return httpx.Response(200, text="<uws:job/>")
+
+    client = make_client(tap)
+    jobref = await asyncio.wait_for(
+        client.resolve_jobref_id("aaaaaaaaaaaaaaaa"), timeout=2
+    )
+    assert jobref.dataset == "lsstcam"
+    assert jobref.endpoint == f"{BASE_URL}/api/ssotap"
+    assert cancelled
+
+
+@pytest.mark.asyncio
+async def test_jobref_index() -> None:
+    """Jobrefs seen in history, and jobrefs known to be absent, resolve
+    without any further requests.
+    """
+    requested: list[str] = []
+
+    async def tap(request: httpx.Request) -> httpx.Response:
+        requested.append(request.url.path)
+        if request.url.path == "/api/ssotap/async":
+            return httpx.Response(
+                200,
+                text=jobs_xml(jobref_xml("aaaaaaaaaaaaaaaa")),
+            )
+        return httpx.Response(404)
+
+    client = make_client(tap)
+    await client.get_query_history(5)
+    requested.clear()
+    jobref = await client.resolve_jobref_id("aaaaaaaaaaaaaaaa")
+    assert jobref.dataset == "lsstcam"
+    assert requested == []
+
+    with pytest.raises(UnknownDatasetError):
+        await client.resolve_jobref_id("zzzzzzzzzzzzzzzz")
+    assert len(requested) == 2
+    with pytest.raises(UnknownDatasetError):
+        await client.resolve_jobref_id("zzzzzzzzzzzzzzzz")
+    assert len(requested) == 2
+
+
+@pytest.mark.asyncio
+async def test_jobref_index_bounded() -> None:
+    """The jobref index and the absent jobrefs are kept within bounds, and
+    expired absent jobrefs are dropped as new ones are added.
+    """
+
+    async def tap(request: httpx.Request) -> httpx.Response:
+        if request.url.path == "/api/ssotap/async":
+            return httpx.Response(
+                200,
+                text=jobs_xml(
+                    *(
+                        jobref_xml(
+                            f"{i:016d}",
+                            creation_time=f"2026-01-01T00:00:{i:02d}",
+                        )
+                        for i in range(5)
+                    )
+                ),
+            )
+        return httpx.Response(404)
+
+    client = make_client(tap, max_jobrefs=3, negative_cache_ttl=0.05)
+    await client.get_query_history(0)
+    assert list(client._jobref_index) == [f"{i:016d}" for i in (2, 3, 4)]
+
+    for jobref_id in ("x" * 16, "y" * 16, "z" * 16, "w" * 16):
+        with pytest.raises(UnknownDatasetError):
+            await client.resolve_jobref_id(jobref_id)
+    assert list(client._absent_jobrefs) == ["y" * 16, "z" * 16, "w" * 16]
+    await asyncio.sleep(0.1)
+    with pytest.raises(UnknownDatasetError):
+        await client.resolve_jobref_id("v" * 16)
+    assert list(client._absent_jobrefs) == ["v" * 16]
+
+
+@pytest.mark.asyncio
+async def test_query_history_single_flight() -> None:
+    """Concurrent history requests share one fetch, and smaller requests
+    are answered from larger ones.
+    """
+    requests = 0
+
+    async def tap(request: httpx.Request) -> httpx.Response:
+        nonlocal requests
+        if request.url.path != "/api/ssotap/async":
+            return httpx.Response(404)
+        requests += 1
+        await asyncio.sleep(0.1)
+        return httpx.Response(
+            200,
+            text=jobs_xml(
+                jobref_xml("aaaaaaaaaaaaaaaa"),
+                jobref_xml(
+                    "bbbbbbbbbbbbbbbb",
+                    creation_time="2026-02-01T00:00:00.000Z",
+                ),
+                jobref_xml(
+                    "cccccccccccccccc",
+                    creation_time="2026-03-01T00:00:00.000Z",
+                ),
+            ),
+        )
+
+    client = make_client(tap, history_ttl=60.0)
+    # Warm up discovery so that the requests start together.
+    await client.get_tap_endpoints()
+    big, same, small = await asyncio.gather(
+        client.get_query_history(3),
+        client.get_query_history(3),
+        client.get_query_history(1),
+    )
+    assert requests == 1
+    assert [j["@id"] for j in big["lsstcam"]] == [
+        "cccccccccccccccc",
+        "bbbbbbbbbbbbbbbb",
+        "aaaaaaaaaaaaaaaa",
+    ]
+    assert same == big
+    assert same["lsstcam"] is not big["lsstcam"]
+    assert [j["@id"] for j in small["lsstcam"]] == ["cccccccccccccccc"]
+
+    # A recent result answers smaller requests but not larger ones.
+    await client.get_query_history(2)
+    assert requests == 1
+    await client.get_query_history(0)
+    assert requests == 2
+
+
+@pytest.mark.asyncio
+async def test_discovery_warm_start(tmp_path: Path) -> None:
+    """A snapshot on disk is served at once, then revalidated and saved."""
+    cache_file = tmp_path / "discovery.json"
+    cache_file.write_text(
+        json.dumps(
+            {
+                "base_url": REPERTOIRE_URL,
+                "fetched_at": 0.0,
+                "datasets": ["dp02"],
+                "tap_urls": {"dp02": f"{BASE_URL}/old/tap"},
+                "times_square_url": f"{BASE_URL}/old/times-square",
+            }
+        )
+    )
+
+    async def tap(request: httpx.Request) -> httpx.Response:
+        return httpx.Response(404)
+
+    client = make_client(tap, cache_file=cache_file)
+    assert await client.get_times_square_url() == (
+        f"{BASE_URL}/old/times-square"
+    )
+    assert await client.get_tap_endpoints() == {"dp02": f"{BASE_URL}/old/tap"}
+
+    # Let the background revalidation finish.
+    for _ in range(100):
+        await asyncio.sleep(0.01)
+        if await client.get_datasets() == ["dp02", "dp1", "lsstcam"]:
+            break
+    assert await client.get_times_square_url() == (
+        f"{BASE_URL}/times-square/api"
+    )
+    saved = json.loads(cache_file.read_text())
+    assert saved["tap_urls"]["lsstcam"] == f"{BASE_URL}/api/ssotap"
@@ -1,9 +1,137 @@
-"""Fixture for test suite."""
+"""Fixtures and shared builders for the test suite."""
+import json
 import os
+from collections.abc import Awaitable, Callable
 from pathlib import Path
+from typing import Any
 
+import httpx
 import pytest
 from pyfakefs.fake_filesystem import FakeFilesystem
+from rubin.repertoire import DiscoveryClient
+
+from rsp_jupyter_extensions.handlers.clients import RSPClient
+from rsp_jupyter_extensions.handlers.discovery import DiscoveryCache
+
+BASE_URL = "https://example.lsst.cloud"
+REPERTOIRE_URL = f"{BASE_URL}/repertoire"
+
+DISCOVERY = {
+    "datasets": {
+        "dp02": {"services": {"tap": {"url": f"{BASE_URL}/api/tap"}}},
+        "dp1": {"services": {"tap": {"url": f"{BASE_URL}/api/tap"}}},
+        "lsstcam": {"services": {"tap": {"url": f"{BASE_URL}/api/ssotap"}}},
+    },
+    "services": {
+        "internal": {"times-square": {"url": f"{BASE_URL}/times-square/api"}},
+        "ui": {},
+    },
+}
+
+
+def make_client(
+    tap: Callable[[httpx.Request], Awaitable[httpx.Response]],
+    cache_file: Path | None = None,
+    **kwargs: float,
+) -> RSPClient:
+    """Build an RSPClient whose HTTP traffic is answered by ``tap``,
+    except for discovery, which is answered from ``DISCOVERY``.
+    """
+
+    async def handler(request: httpx.Request) -> httpx.Response:
+        if request.url.path == "/repertoire/discovery":
+            return httpx.Response(200, json=DISCOVERY)
+        return await tap(request)
+
+    transport = httpx.MockTransport(handler)
+    anonymous_client = httpx.AsyncClient(transport=transport)
+    authed_client = httpx.AsyncClient(transport=transport)
+    discovery_client = DiscoveryClient(
+        anonymous_client, base_url=REPERTOIRE_URL
+    )
+    discovery_cache = DiscoveryCache(
+        discovery_client, cache_file=cache_file, base_url=REPERTOIRE_URL
+    )
+    return RSPClient(
+        discovery_client=discovery_client,
+        anonymous_client=anonymous_client,
+        authed_client=authed_client,
+        discovery_cache=discovery_cache,
+        **kwargs,  # type: ignore[arg-type]
+    )
+
+
+def jobref_xml(
+    job_id: str,
+    *,
+    phase: str = "COMPLETED",
+    creation_time: str = "2026-01-01T00:00:00.000Z",
+) -> str:
+    """Build one UWS jobref, for `jobs_xml`."""
+    return (
+        f'<uws:jobref id="{job_id}"><uws:phase>{phase}</uws:phase>'
+        f"<uws:creationTime>{creation_time}</uws:creationTime></uws:jobref>"
+    )
+
+
+def jobs_xml(*jobrefs: str) -> str:
+    """Build a UWS job list from jobrefs built by `jobref_xml`."""
+    return (
+        '<uws:jobs xmlns:uws="http://www.ivoa.net/xml/UWS/v1.0"'
+        ' xmlns:xlink="http://www.w3.org/1999/xlink">'
+        f"{''.join(jobrefs)}</uws:jobs>"
+    )
+
+
+def job_xml(query: str) -> str:
+    """Build a UWS job document for a TAP query."""
+    return (
+        '<uws:job xmlns:uws="http://www.ivoa.net/xml/UWS/v1.0">'
+        "<uws:phase>COMPLETED</uws:phase>"
+        "<uws:parameters>"
+        '<uws:parameter id="LANG">ADQL</uws:parameter>'
+        f'<uws:parameter id="QUERY">{query}</uws:parameter>'
+        "</uws:parameters></uws:job>"
+    )
+
+
+def notebook_json(
+    *sources: str, metadata: dict[str, Any] | None = None
+) -> str:
+    """Build a notebook with a code cell for each source."""
+    return json.dumps(
+        {
+            "cells": [
+                {
+                    "cell_type": "code",
+                    "execution_count": None,
+                    "id": f"cell{i}",
+                    "metadata": {},
+                    "outputs": [],
+                    "source": source,
+                }
+                for i, source in enumerate(sources)
+            ],
+            "metadata": metadata or {},
+            "nbformat": 4,
+            "nbformat_minor": 5,
+        }
+    )
+
+
+def query_template(body: str) -> str:
+    """Build a Times Square template notebook for the query page."""
+    return notebook_json(
+        "# Parameters\nquery_url = ''",
+        body,
+        metadata={"times-square": {"parameters": {"query_url": {}}}},
+    )
+
+
+def query_rendering(url: str, body: str) -> str:
+    """Build the notebook Times Square renders from `query_template`."""
+    return notebook_json(f"# Parameters\nquery_url = {url!r}", body)
+
 
 @pytest.fixture
 def rsp_fs(
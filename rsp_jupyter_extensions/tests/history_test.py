@@ -0,0 +1,263 @@
+"""Test the shared TAP query history."""
+
+import asyncio
+
+import httpx
+import pytest
+
+from rsp_jupyter_extensions.handlers.cache import LRUCache
+from rsp_jupyter_extensions.handlers.history import QueryHistory
+
+from .conftest import (
+    job_xml,
+    jobref_xml,
+    jobs_xml,
+    make_client,
+)
+
+
+@pytest.mark.asyncio
+async def test_history_events() -> None:
+    """Subscribers get the current history, then only what changes, and
+    polling stops when the last subscriber leaves.
+    """
+    phases = {"aaaaaaaaaaaaaaaa": "EXECUTING"}
+    polls = 0
+
+    async def tap(request: httpx.Request) -> httpx.Response:
+        nonlocal polls
+        path = request.url.path
+        if path == "/api/ssotap/async":
+            polls += 1
+            return httpx.Response(
+                200,
+                text=jobs_xml(
+                    *(jobref_xml(j, phase=p) for j, p in phases.items())
+                ),
+            )
+        if path.startswith("/api/ssotap/async/"):
+            job_id = path.rsplit("/", 1)[-1]
+            return httpx.Response(200, text=job_xml(f"SELECT '{job_id}'"))
+        return httpx.Response(404)
+
+    client = make_client(tap, history_ttl=0.0)
+    history = QueryHistory(client, LRUCache(), poll_interval=0.05)
+    queue = history.subscribe()
+    event = await asyncio.wait_for(queue.get(), timeout=2)
+    assert event.jobref == "lsstcam:aaaaaaaaaaaaaaaa"
+    assert event.phase == "EXECUTING"
+    assert event.text == "SELECT 'aaaaaaaaaaaaaaaa'"
+
+    phases["aaaaaaaaaaaaaaaa"] = "COMPLETED"
+    phases["bbbbbbbbbbbbbbbb"] = "PENDING"
+    events = [await asyncio.wait_for(queue.get(), timeout=2) for _ in (1, 2)]
+    assert {(e.jobref, e.phase) for e in events} == {
+        ("lsstcam:aaaaaaaaaaaaaaaa", "COMPLETED"),
+        ("lsstcam:bbbbbbbbbbbbbbbb", "PENDING"),
+    }
+
+    # Nothing changes, so nothing more is sent.
+    await asyncio.sleep(0.2)
+    assert queue.empty()
+
+    # A new subscriber starts with the whole history.
+    late = history.subscribe()
+    assert late.qsize() == 2
+
+    history.unsubscribe(queue)
+    history.unsubscribe(late)
+    await asyncio.sleep(0.2)
+    stopped = polls
+    await asyncio.sleep(0.2)
+    assert polls == stopped
+
+    # Closing stops polling even with subscribers left.
+    history.subscribe()
+    await asyncio.sleep(0.1)
+    await history.aclose()
+    stopped = polls
+    await asyncio.sleep(0.2)
+    assert polls == stopped
+
+
+@pytest.mark.asyncio
+async def test_stale_history() -> None:
+    """When the TAP services miss the deadline, the last history is served,
+    marked stale, and the refresh finishes in the background.
+    """
+    phases = {"aaaaaaaaaaaaaaaa": "COMPLETED"}
+    delay = 0.0
+
+    async def tap(request: httpx.Request) -> httpx.Response:
+        path = request.url.path
+        if path == "/api/ssotap/async":
+            await asyncio.sleep(delay)
+            return httpx.Response(
+                200,
+                text=jobs_xml(
+                    *(jobref_xml(j, phase=p) for j, p in phases.items())
+                ),
+            )
+        if path.startswith("/api/ssotap/async/"):
+            job_id = path.rsplit("/", 1)[-1]
+            return httpx.Response(200, text=job_xml(f"SELECT '{job_id}'"))
+        return httpx.Response(404)
+
+    client = make_client(tap, history_ttl=0.0, max_retries=0)
+    history = QueryHistory(client, LRUCache())
+    fresh = await history.get_history(5, deadline=0.1)
+    assert not fresh.stale
+    assert len(fresh.history["lsstcam"]) == 1
+
+    phases["bbbbbbbbbbbbbbbb"] = "COMPLETED"
+    delay = 0.3
+    stale = await history.get_history(5, deadline=0.1)
+    assert stale.stale
+    assert stale.history == fresh.history
+
+    await asyncio.sleep(0.5)
+    delay = 0.0
+    fresh = await history.get_history(5, deadline=0.1)
+    assert not fresh.stale
+    assert len(fresh.history["lsstcam"]) == 2
+
+
+@pytest.mark.asyncio
+async def test_query_metadata() -> None:
+    """Job metadata comes from the job document, is cached with the text
+    once the job is finished, and old text-only cache entries are refetched.
+    Times a job does not have yet are nil, and are left unset.
+    """
+    phase = "PENDING"
+    times: dict[str, str | None] = dict.fromkeys(
+        ("startTime", "endTime", "executionDuration")
+    )
+    fetches = 0
+
+    async def tap(request: httpx.Request) -> httpx.Response:
+        nonlocal fetches
+        if request.url.path == "/api/ssotap/async/aaaaaaaaaaaaaaaa":
+            fetches += 1
+            return httpx.Response(
+                200,
+                text=(
+                    '<uws:job xmlns:uws="http://www.ivoa.net/xml/UWS/v1.0"'
+                    ' xmlns:xlink="http://www.w3.org/1999/xlink"'
+                    ' xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance">'
+                    f"<uws:phase>{phase}</uws:phase>"
+                    "<uws:creationTime>2026-01-01T00:00:00Z</uws:creationTime>"
+                    + "".join(
+                        f'<uws:{name} xsi:nil="true"/>'
+                        if value is None
+                        else f"<uws:{name}>{value}</uws:{name}>"
+                        for name, value in times.items()
+                    )
+                    + "<uws:parameters>"
+                    '<uws:parameter id="QUERY">SELECT 1</uws:parameter>'
+                    "</uws:parameters><uws:results>"
+                    '<uws:result id="result" rowCount="42"'
+                    ' xlink:href="https://x/result"/>'
+                    "</uws:results></uws:job>"
+                ),
+            )
+        return httpx.Response(404)
+
+    cache = LRUCache()
+    history = QueryHistory(make_client(tap), cache)
+    job = "lsstcam:aaaaaaaaaaaaaaaa"
+    query = await history.get_query_text_job(job)
+    assert query.text == "SELECT 1"
+    assert query.phase == "PENDING"
+    assert query.start_time is None
+    assert query.execution_duration is None
+
+    phase = "EXECUTING"
+    times["startTime"] = "2026-01-01T00:00:01Z"
+    times["executionDuration"] = "600"
+    query = await history.get_query_text_job(job)
+    assert query.phase == "EXECUTING"
+    assert query.start_time == "2026-01-01T00:00:01Z"
+    assert query.end_time is None
+    assert query.execution_duration == 600
+    assert job not in cache
+
+    phase = "COMPLETED"
+    times["endTime"] = "2026-01-01T00:00:05Z"
+    query = await history.get_query_text_job(job)
+    assert query.model_dump() == {
+        "jobref": job,
+        "text": "SELECT 1",
+        "phase": "COMPLETED",
+        "creation_time": "2026-01-01T00:00:00Z",
+        "start_time": "2026-01-01T00:00:01Z",
+        "end_time": "2026-01-01T00:00:05Z",
+        "execution_duration": 600,
+        "row_count": 42,
+    }
+    assert await history.get_query_text_job(job) == query
+    assert fetches == 3
+
+    cache.put(job, "SELECT 1")
+    assert await history.get_query_text_job(job) == query
+    assert fetches == 4
+
+
+@pytest.mark.asyncio
+async def test_shared_endpoint_documents() -> None:
+    """A job seen through two datasets on one endpoint is fetched once."""
+    fetches = 0
+
+    async def tap(request: httpx.Request) -> httpx.Response:
+        nonlocal fetches
+        path = request.url.path
+        if path == "/api/tap/async":
+            return httpx.Response(
+                200, text=jobs_xml(jobref_xml("aaaaaaaaaaaaaaaa"))
+            )
+        if path == "/api/tap/async/aaaaaaaaaaaaaaaa":
+            fetches += 1
+            await asyncio.sleep(0.05)
+            return httpx.Response(200, text=job_xml("SELECT 1"))
+        return httpx.Response(200, text=jobs_xml())
+
+    history = QueryHistory(make_client(tap), LRUCache())
+    response = await history.refresh(5)
+    assert response.history["dp02"][0].text == "SELECT 1"
+    assert response.history["dp1"][0].text == "SELECT 1"
+    assert fetches == 1
+
+
+@pytest.mark.asyncio
+async def test_all_history() -> None:
+    """A count of zero means all jobs, and a shorter refresh does not take
+    away the stale fallback of a longer request.
+    """
+    jobs = {f"{i:016d}": "COMPLETED" for i in range(8)}
+    delay = 0.0
+
+    async def tap(request: httpx.Request) -> httpx.Response:
+        path = request.url.path
+        if path == "/api/ssotap/async":
+            await asyncio.sleep(delay)
+            return httpx.Response(
+                200,
+                text=jobs_xml(
+                    *(jobref_xml(j, phase=p) for j, p in jobs.items())
+                ),
+            )
+        if path.startswith("/api/ssotap/async/"):
+            job_id = path.rsplit("/", 1)[-1]
+            return httpx.Response(200, text=job_xml(f"SELECT '{job_id}'"))
+        return httpx.Response(404)
+
+    client = make_client(tap, history_ttl=0.0, max_retries=0)
+    history = QueryHistory(client, LRUCache())
+    fresh = await history.get_history(0, deadline=1)
+    assert len(fresh.history["lsstcam"]) == 8
+    assert len((await history.refresh()).history["lsstcam"]) == 5
+
+    delay = 0.3
+    stale = await history.get_history(0, deadline=0.1)
+    assert stale.stale
+    assert len(stale.history["lsstcam"]) == 8
+    await history.aclose()
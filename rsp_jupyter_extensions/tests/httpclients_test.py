@@ -0,0 +1,101 @@
+"""Test the shared HTTP client pools."""
+
+import asyncio
+import os
+from pathlib import Path
+from typing import Any
+
+import httpx
+import pytest
+
+from rsp_jupyter_extensions.handlers._utils import (
+    TokenNotAvailableError,
+    TokenProvider,
+)
+from rsp_jupyter_extensions.handlers.httpclients import (
+    HTTPClientManager,
+    TokenAuth,
+    _PerHostLimitTransport,
+)
+
+
+@pytest.mark.asyncio
+async def test_per_host_limit() -> None:
+    """Requests to one host are capped; other hosts are unaffected."""
+    in_flight: dict[str, int] = {}
+    most: dict[str, int] = {}
+
+    async def handler(request: httpx.Request) -> httpx.Response:
+        host = request.url.host
+        in_flight[host] = in_flight.get(host, 0) + 1
+        most[host] = max(most.get(host, 0), in_flight[host])
+        await asyncio.sleep(0.02)
+        in_flight[host] -= 1
+        return httpx.Response(200, text="ok")
+
+    transport = _PerHostLimitTransport(httpx.MockTransport(handler), 2)
+    async with httpx.AsyncClient(transport=transport) as client:
+        resps = await asyncio.gather(
+            *(client.get("https://busy.example/") for _ in range(6)),
+            *(client.get("https://quiet.example/") for _ in range(2)),
+        )
+    assert all(r.text == "ok" for r in resps)
+    assert most == {"busy.example": 2, "quiet.example": 2}
+
+
+@pytest.mark.asyncio
+async def test_manager_lifecycle() -> None:
+    """The manager is shared through settings and closes its pools."""
+    settings: dict[str, HTTPClientManager] = {}
+    manager = HTTPClientManager.from_settings(settings)
+    assert HTTPClientManager.from_settings(settings) is manager
+    client = manager.anonymous_client
+    assert manager.anonymous_client is client
+    await manager.aclose()
+    assert client.is_closed
+
+
+@pytest.mark.asyncio
+async def test_token_rotation(
+    tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    """A rotated token is picked up by the existing client, and the token
+    file is only re-read when it changes.
+    """
+    token_file = tmp_path / "secrets" / "token"
+    token_file.parent.mkdir()
+    token_file.write_text("token-one\n")
+    monkeypatch.setenv("NUBLADO_RUNTIME_MOUNTS_DIR", str(tmp_path))
+    provider = TokenProvider()
+    reads = 0
+    read_text = Path.read_text
+
+    def counting_read_text(self: Path, *args: Any, **kwargs: Any) -> str:
+        nonlocal reads
+        reads += 1
+        return read_text(self, *args, **kwargs)
+
+    monkeypatch.setattr(Path, "read_text", counting_read_text)
+
+    seen: list[str] = []
+
+    async def handler(request: httpx.Request) -> httpx.Response:
+        seen.append(request.headers["Authorization"])
+        return httpx.Response(200)
+
+    async with httpx.AsyncClient(
+        auth=TokenAuth(provider), transport=httpx.MockTransport(handler)
+    ) as client:
+        await client.get("https://example.lsst.cloud/")
+        await client.get("https://example.lsst.cloud/")
+        token_file.write_text("token-two\n")
+        stat = token_file.stat()
+        os.utime(token_file, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+        await client.get("https://example.lsst.cloud/")
+
+    assert seen == ["Bearer token-one", "Bearer token-one", "Bearer token-two"]
+    assert reads == 2
+
+    token_file.unlink()
+    with pytest.raises(TokenNotAvailableError):
+        provider.get()
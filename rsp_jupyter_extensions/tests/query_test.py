@@ -0,0 +1,424 @@
+"""Test the TAP query handler."""
+
+import asyncio
+import hashlib
+import json
+from collections.abc import Callable
+from pathlib import Path
+from typing import Any
+
+import httpx
+import pytest
+from tornado.httpclient import HTTPClientError
+
+from rsp_jupyter_extensions.handlers.templates import NotebookTemplates
+
+from .conftest import (
+    job_xml,
+    jobref_xml,
+    jobs_xml,
+    make_client,
+    notebook_json,
+    query_rendering,
+    query_template,
+)
+
+JOBS = [
+    ("aaaaaaaaaaaaaaaa", "2026-01-01T00:00:00.000Z"),
+    ("bbbbbbbbbbbbbbbb", "2026-02-01T00:00:00.000Z"),
+    ("cccccccccccccccc", "2026-03-01T00:00:00.000Z"),
+]
+
+
+@pytest.fixture
+def query_settings(
+    jp_serverapp: Any, tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+) -> dict[str, Any]:
+    """Query handler settings, with no RSP client or stores yet."""
+    monkeypatch.setenv("HOME", str(tmp_path))
+    monkeypatch.setenv("XDG_CACHE_HOME", str(tmp_path / "cache"))
+    settings = jp_serverapp.web_app.settings
+    settings["query"] = {"store": None}
+    return settings["query"]
+
+
+async def test_history_text_concurrent(
+    jp_fetch: Callable, query_settings: dict[str, Any]
+) -> None:
+    """Query text is fetched concurrently, failures are skipped, and each
+    dataset keeps its newest-first order.
+    """
+    in_flight = 0
+    max_in_flight = 0
+
+    async def tap(request: httpx.Request) -> httpx.Response:
+        nonlocal in_flight, max_in_flight
+        path = request.url.path
+        if not path.startswith("/api/tap/"):
+            return httpx.Response(404)
+        if path == "/api/tap/async":
+            return httpx.Response(
+                200,
+                text=jobs_xml(
+                    *(jobref_xml(j, creation_time=c) for j, c in JOBS)
+                ),
+            )
+        job_id = path.rsplit("/", 1)[-1]
+        if job_id == "bbbbbbbbbbbbbbbb":
+            return httpx.Response(500)
+        in_flight += 1
+        max_in_flight = max(max_in_flight, in_flight)
+        # Make the oldest job the slowest, to check ordering.
+        await asyncio.sleep(0.2 if job_id == "aaaaaaaaaaaaaaaa" else 0.05)
+        in_flight -= 1
+        return httpx.Response(200, text=job_xml(f"SELECT '{job_id}'"))
+
+    query_settings["client"] = make_client(tap)
+    response = await jp_fetch("rubin", "queries", "tap", "history", "5")
+    body = json.loads(response.body)
+    history = body["history"]
+    assert list(history) == ["dp02", "dp1"]
+    assert body["status"]["dp1"] == {"status": "ok", "detail": None}
+    assert body["status"]["lsstcam"]["status"] == "failed"
+    assert [q["jobref"] for q in history["dp1"]] == [
+        "dp1:cccccccccccccccc",
+        "dp1:aaaaaaaaaaaaaaaa",
+    ]
+    assert history["dp1"][1]["text"] == "SELECT 'aaaaaaaaaaaaaaaa'"
+    assert max_in_flight > 1
+
+
+async def test_history_bad_deadline(
+    jp_fetch: Callable, query_settings: dict[str, Any]
+) -> None:
+    """A deadline that is not a number is a client error."""
+
+    async def tap(request: httpx.Request) -> httpx.Response:
+        return httpx.Response(404)
+
+    query_settings["client"] = make_client(tap)
+    with pytest.raises(HTTPClientError) as excinfo:
+        await jp_fetch(
+            "rubin",
+            "queries",
+            "tap",
+            "history",
+            "5",
+            params={"deadline": "soon"},
+        )
+    assert excinfo.value.code == 400
+
+
+async def test_history_event_stream(
+    jp_fetch: Callable,
+    query_settings: dict[str, Any],
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    """History changes are pushed as server-sent events."""
+    monkeypatch.setenv("QUERY_EVENTS_KEEPALIVE", "0.1")
+
+    async def tap(request: httpx.Request) -> httpx.Response:
+        path = request.url.path
+        if path == "/api/ssotap/async":
+            return httpx.Response(
+                200,
+                text=jobs_xml(
+                    jobref_xml(JOBS[0][0], creation_time=JOBS[0][1])
+                ),
+            )
+        if path.startswith("/api/ssotap/async/"):
+            return httpx.Response(200, text=job_xml("SELECT 1"))
+        return httpx.Response(404)
+
+    query_settings["client"] = make_client(tap)
+    chunks: list[bytes] = []
+    with pytest.raises(HTTPClientError):
+        await jp_fetch(
+            "rubin",
+            "queries",
+            "tap",
+            "events",
+            streaming_callback=chunks.append,
+            request_timeout=1,
+        )
+    body = b"".join(chunks).decode()
+    assert ": keepalive\n\n" in body
+    events = [
+        json.loads(line.removeprefix("data: "))
+        for line in body.splitlines()
+        if line.startswith("data: ")
+    ]
+    assert events == [
+        {
+            "dataset": "lsstcam",
+            "jobref": "lsstcam:aaaaaaaaaaaaaaaa",
+            "phase": "COMPLETED",
+            "creation_time": "2026-01-01T00:00:00.000Z",
+            "text": "SELECT 1",
+        }
+    ]
+
+
+async def test_history_ndjson(
+    jp_fetch: Callable, query_settings: dict[str, Any]
+) -> None:
+    """Streamed history has one line per dataset, fastest first."""
+
+    async def tap(request: httpx.Request) -> httpx.Response:
+        path = request.url.path
+        if path == "/api/ssotap/async":
+            await asyncio.sleep(0.3)
+            return httpx.Response(
+                200,
+                text=jobs_xml(
+                    jobref_xml(JOBS[1][0], creation_time=JOBS[1][1])
+                ),
+            )
+        if path == "/api/tap/async":
+            return httpx.Response(503)
+        job_id = path.rsplit("/", 1)[-1]
+        return httpx.Response(200, text=job_xml(f"SELECT '{job_id}'"))
+
+    query_settings["client"] = make_client(tap, max_retries=0)
+    response = await jp_fetch(
+        "rubin",
+        "queries",
+        "tap",
+        "history",
+        "5",
+        headers={"Accept": "application/x-ndjson"},
+    )
+    assert response.headers["Content-Type"] == "application/x-ndjson"
+    lines = [json.loads(x) for x in response.body.decode().splitlines()]
+    assert [(x["dataset"], x["status"]) for x in lines] == [
+        ("dp02", "failed"),
+        ("dp1", "failed"),
+        ("lsstcam", "ok"),
+    ]
+    assert lines[2]["queries"] == [
+        {
+            "jobref": "lsstcam:bbbbbbbbbbbbbbbb",
+            "text": "SELECT 'bbbbbbbbbbbbbbbb'",
+            "phase": "COMPLETED",
+            "creation_time": None,
+            "start_time": None,
+            "end_time": None,
+            "execution_duration": None,
+            "row_count": None,
+        }
+    ]
+
+
+async def test_local_render(
+    jp_fetch: Callable, query_settings: dict[str, Any]
+) -> None:
+    """The query template is fetched once and, after checking the first
+    rendering against Times Square's, rendered locally; Times Square
+    renders templates we cannot render, or render differently.
+    """
+    source = query_template("url = '{{ params.query_url }}'")
+    remote_body = "url = '{url}'"
+    requests: list[str] = []
+
+    async def tap(request: httpx.Request) -> httpx.Response:
+        path = request.url.path
+        requests.append(path)
+        ts = "/times-square/api/v1/github"
+        if path == f"{ts}/lsst-sqre/nublado-seeds/tap/query":
+            return httpx.Response(
+                200,
+                json={
+                    "parameters": {"query_url": {"type": "string"}},
+                    "source_url": "https://example.lsst.cloud/source",
+                },
+            )
+        if path == "/source":
+            return httpx.Response(200, text=source)
+        if path.startswith(f"{ts}/rendered/"):
+            url = request.url.params["query_url"]
+            body = remote_body.format(url=url)
+            return httpx.Response(200, text=query_rendering(url, body))
+        return httpx.Response(404)
+
+    async def open_query(job_id: str) -> dict[str, Any]:
+        url = f"https://example.lsst.cloud/api/tap/async/{job_id}"
+        response = await jp_fetch(
+            "rubin",
+            "queries",
+            method="POST",
+            body=json.dumps({"type": "tap", "value": url}),
+        )
+        nb = json.loads(json.loads(response.body)["body"])
+        assert "".join(nb["cells"][0]["source"]) == (
+            f"# Parameters\nquery_url = {url!r}"
+        )
+        assert "times-square" not in nb["metadata"]
+        return nb
+
+    query_settings["client"] = make_client(tap)
+    for job_id in ("aaaaaaaaaaaaaaaa", "bbbbbbbbbbbbbbbb", "cccccccccccccccc"):
+        nb = await open_query(job_id)
+        assert "".join(nb["cells"][1]["source"]).startswith("url = ")
+    assert requests.count("/source") == 1
+    assert len([r for r in requests if "/rendered/" in r]) == 1
+
+    # If Times Square renders it differently, it renders it every time.
+    remote_body = "remote = '{url}'"
+    query_settings["templates"] = NotebookTemplates(query_settings["client"])
+    requests.clear()
+    for job_id in ("dddddddddddddddd", "eeeeeeeeeeeeeeee"):
+        nb = await open_query(job_id)
+        assert "".join(nb["cells"][1]["source"]).startswith("remote = ")
+    assert len([r for r in requests if "/rendered/" in r]) == 2
+
+    # A template needing more than the parameters goes to Times Square.
+    source = query_template("{{ params.query_url }} {{ now() }}")
+    query_settings["templates"] = NotebookTemplates(query_settings["client"])
+    requests.clear()
+    nb = await open_query("ffffffffffffffff")
+    assert "".join(nb["cells"][1]["source"]).startswith("remote = ")
+    assert len([r for r in requests if "/rendered/" in r]) == 1
+
+
+async def test_notebook_write(
+    jp_fetch: Callable, query_settings: dict[str, Any], tmp_path: Path
+) -> None:
+    """Query notebooks are written whole, and not rewritten unchanged."""
+
+    async def tap(request: httpx.Request) -> httpx.Response:
+        if request.url.path.startswith("/times-square/api/v1/github/"):
+            return httpx.Response(200, text=notebook_json("SELECT 1"))
+        return httpx.Response(404)
+
+    query_settings["client"] = make_client(tap)
+    url = "https://example.lsst.cloud/api/tap/async/aaaaaaaaaaaaaaaa"
+    body = json.dumps({"type": "tap", "value": url})
+    await jp_fetch("rubin", "queries", method="POST", body=body)
+    queries = tmp_path / "notebooks" / "queries"
+    target = queries / "tap_aaaaaaaaaaaaaaaa.ipynb"
+    assert [p.name for p in queries.iterdir()] == [target.name]
+    mtime = target.stat().st_mtime_ns
+
+    response = await jp_fetch("rubin", "queries", method="POST", body=body)
+    assert json.loads(response.body)["body"] == target.read_text()
+    assert target.stat().st_mtime_ns == mtime
+
+    # Clients can ask for less than the whole notebook back.
+    response = await jp_fetch(
+        "rubin", "queries", method="POST", body=body, params={"body": "none"}
+    )
+    assert "body" not in json.loads(response.body)
+    response = await jp_fetch(
+        "rubin", "queries", method="POST", body=body, params={"body": "hash"}
+    )
+    reply = json.loads(response.body)
+    assert "body" not in reply
+    assert reply["sha256"] == hashlib.sha256(target.read_bytes()).hexdigest()
+    assert reply["path"] == "notebooks/queries/tap_aaaaaaaaaaaaaaaa.ipynb"
+    with pytest.raises(HTTPClientError) as excinfo:
+        await jp_fetch(
+            "rubin", "queries", method="POST", body=body, params={"body": "x"}
+        )
+    assert excinfo.value.code == 400
+
+
+async def test_batch_open(
+    jp_fetch: Callable, query_settings: dict[str, Any], tmp_path: Path
+) -> None:
+    """Several queries are opened concurrently in one request, each with
+    its own result, and the history is refreshed once.
+    """
+    in_flight = 0
+    max_in_flight = 0
+
+    async def tap(request: httpx.Request) -> httpx.Response:
+        nonlocal in_flight, max_in_flight
+        if not request.url.path.startswith("/times-square/api/v1/github/"):
+            return httpx.Response(404)
+        in_flight += 1
+        max_in_flight = max(max_in_flight, in_flight)
+        await asyncio.sleep(0.05)
+        in_flight -= 1
+        return httpx.Response(200, text=notebook_json("SELECT 1"))
+
+    class Refresher:
+        scheduled = 0
+
+        def schedule(self, func: Callable) -> None:
+            self.scheduled += 1
+
+        async def aclose(self) -> None:
+            pass
+
+    refresher = Refresher()
+    query_settings["client"] = make_client(tap)
+    query_settings["refresher"] = refresher
+    values = [
+        f"https://example.lsst.cloud/api/tap/async/{j_id}"
+        for j_id, _ in JOBS[:2]
+    ]
+    values.append("nope:aaaaaaaaaaaaaaaa")
+    response = await jp_fetch(
+        "rubin",
+        "queries",
+        method="POST",
+        body=json.dumps({"type": "tap", "values": values}),
+        params={"body": "none"},
+    )
+    results = json.loads(response.body)
+    assert [r["value"] for r in results] == values
+    assert [r["status"] for r in results] == [200, 200, 500]
+    assert results[0]["path"] == "notebooks/queries/tap_aaaaaaaaaaaaaaaa.ipynb"
+    assert "body" not in results[1]
+    assert "nope" in results[2]["error"]
+    assert (tmp_path / results[1]["path"]).is_file()
+    assert max_in_flight > 1
+    assert refresher.scheduled == 1
+
+
+async def test_open_queries_limit(
+    jp_fetch: Callable,
+    query_settings: dict[str, Any],
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    """Opening several queries is limited to $QUERY_OPEN_CONCURRENCY at a
+    time, and "values" must be a list of strings.
+    """
+    in_flight = 0
+    max_in_flight = 0
+
+    async def tap(request: httpx.Request) -> httpx.Response:
+        nonlocal in_flight, max_in_flight
+        if not request.url.path.startswith("/times-square/api/v1/github/"):
+            return httpx.Response(404)
+        in_flight += 1
+        max_in_flight = max(max_in_flight, in_flight)
+        await asyncio.sleep(0.02)
+        in_flight -= 1
+        return httpx.Response(200, text=notebook_json("SELECT 1"))
+
+    monkeypatch.setenv("QUERY_OPEN_CONCURRENCY", "2")
+    query_settings["client"] = make_client(tap)
+    values = [
+        f"https://example.lsst.cloud/api/tap/async/{c * 16}" for c in "abcdef"
+    ]
+    response = await jp_fetch(
+        "rubin",
+        "queries",
+        method="POST",
+        body=json.dumps({"type": "tap", "values": values}),
+        params={"body": "none"},
+    )
+    results = json.loads(response.body)
+    assert [r["status"] for r in results] == [200] * len(values)
+    assert max_in_flight == 2
+
+    for bad in (values[0], [values[0], 1], {"value": values[0]}):
+        with pytest.raises(HTTPClientError) as excinfo:
+            await jp_fetch(
+                "rubin",
+                "queries",
+                method="POST",
+                body=json.dumps({"type": "tap", "values": bad}),
+            )
+        assert excinfo.value.code == 400
@@ -0,0 +1,43 @@
+"""Test retry delays and circuit breaking."""
+
+import time
+
+import pytest
+
+from rsp_jupyter_extensions.handlers._retry import (
+    CircuitBreaker,
+    backoff_delay,
+)
+
+
+def test_backoff_delay() -> None:
+    """Delays are random, grow with each attempt, and are capped."""
+    for attempt in range(6):
+        delay = backoff_delay(attempt, 0.5, 4.0)
+        assert 0 <= delay <= min(4.0, 0.5 * 2**attempt)
+
+
+def test_circuit_breaker(monkeypatch: pytest.MonkeyPatch) -> None:
+    """The circuit opens after repeated failures and lets one trial call
+    through once the cool-down has passed.
+    """
+    now = 1000.0
+    monkeypatch.setattr(time, "monotonic", lambda: now)
+    breaker = CircuitBreaker(threshold=2, cooldown=60.0)
+    breaker.record_failure()
+    assert breaker.allow()
+    breaker.record_failure()
+    assert breaker.is_open
+    assert not breaker.allow()
+
+    now += 61
+    assert breaker.allow()
+    assert not breaker.allow()
+    breaker.record_failure()
+    assert not breaker.allow()
+
+    now += 61
+    assert breaker.allow()
+    breaker.record_success()
+    assert not breaker.is_open
+    assert breaker.allow()
@@ -0,0 +1,98 @@
+"""Test rendering and caching of Times Square notebooks."""
+
+import json
+
+import httpx
+import pytest
+
+from rsp_jupyter_extensions.handlers.templates import NotebookTemplates
+
+from .conftest import (
+    make_client,
+    notebook_json,
+    query_rendering,
+    query_template,
+)
+
+TS = "/times-square/api/v1/github"
+KEY = ("lsst-sqre", "nublado-seeds", "tap")
+
+
+@pytest.mark.asyncio
+async def test_render_cache() -> None:
+    """Renderings are reused until they expire, then revalidated, and
+    dropped when the template changes.
+    """
+    body = "url = '{{ params.query_url }}'"
+    requests: list[tuple[str, str | None]] = []
+
+    async def tap(request: httpx.Request) -> httpx.Response:
+        path = request.url.path
+        requests.append((path, request.headers.get("If-None-Match")))
+        if path == f"{TS}/{'/'.join(KEY)}/query":
+            return httpx.Response(
+                200,
+                json={
+                    "parameters": {"query_url": {"type": "string"}},
+                    "source_url": "https://example.lsst.cloud/source",
+                },
+                headers={"ETag": '"page"'},
+            )
+        if path == "/source":
+            source = query_template(body)
+            etag = f'"{len(source)}"'
+            if request.headers.get("If-None-Match") == etag:
+                return httpx.Response(304)
+            return httpx.Response(200, text=source, headers={"ETag": etag})
+        if path == f"{TS}/rendered/{'/'.join(KEY)}/query":
+            url = request.url.params["query_url"]
+            rendered = body.replace("{{ params.query_url }}", url)
+            return httpx.Response(200, text=query_rendering(url, rendered))
+        if path == f"{TS}/rendered/{'/'.join(KEY)}/history":
+            if request.headers.get("If-None-Match") == '"history"':
+                return httpx.Response(304)
+            return httpx.Response(
+                200,
+                text=notebook_json("history"),
+                headers={"ETag": '"history"'},
+            )
+        return httpx.Response(404)
+
+    templates = NotebookTemplates(make_client(tap), ttl=60)
+    for _ in range(3):
+        history = await templates.render(*KEY, "history", {})
+        query = await templates.render(*KEY, "query", {"query_url": "u"})
+    assert "history" in history
+    assert "url = 'u'" in query
+    # There is no history page, so Times Square renders that one; the
+    # query page is rendered by Times Square once, to check ours.
+    assert [path for path, _ in requests if "/discovery" not in path] == [
+        f"{TS}/{'/'.join(KEY)}/history",
+        f"{TS}/rendered/{'/'.join(KEY)}/history",
+        f"{TS}/{'/'.join(KEY)}/query",
+        "/source",
+        f"{TS}/rendered/{'/'.join(KEY)}/query",
+    ]
+
+    # Once expired, everything is revalidated and reused.
+    templates = NotebookTemplates(make_client(tap), ttl=0)
+    await templates.render(*KEY, "history", {})
+    await templates.render(*KEY, "query", {"query_url": "u"})
+    requests.clear()
+    assert "history" in await templates.render(*KEY, "history", {})
+    assert "url = 'u'" in await templates.render(
+        *KEY, "query", {"query_url": "u"}
+    )
+    assert [r for r in requests if "/discovery" not in r[0]] == [
+        (f"{TS}/{'/'.join(KEY)}/history", None),
+        (f"{TS}/rendered/{'/'.join(KEY)}/history", '"history"'),
+        (f"{TS}/{'/'.join(KEY)}/query", '"page"'),
+        ("/source", f'"{len(query_template(body))}"'),
+    ]
+
+    # A changed template is picked up, and checked again.
+    body = "changed = '{{ params.query_url }}'"
+    requests.clear()
+    rendered = await templates.render(*KEY, "query", {"query_url": "u"})
+    assert json.loads(rendered)["cells"][1]["source"] == "changed = 'u'"
+    assert f"{TS}/rendered/{'/'.join(KEY)}/query" in [r[0] for r in requests]
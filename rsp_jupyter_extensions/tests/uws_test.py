@@ -0,0 +1,91 @@
+"""Test incremental parsing of UWS job lists."""
+
+from xml.etree.ElementTree import ParseError
+
+import pytest
+
+from rsp_jupyter_extensions.handlers._uws import JobListParser, merge_jobrefs
+
+HEADER = (
+    b'<?xml version="1.0" encoding="UTF-8"?>'
+    b'<uws:jobs xmlns:uws="http://www.ivoa.net/xml/UWS/v1.0"'
+    b' xmlns:xlink="http://www.w3.org/1999/xlink">'
+)
+
+
+def _jobref(j_id: str, ctime: str) -> bytes:
+    return (
+        f'<uws:jobref id="{j_id}" xlink:href="https://x/async/{j_id}">'
+        f"<uws:phase>COMPLETED</uws:phase>"
+        f"<uws:creationTime>{ctime}</uws:creationTime>"
+        f"</uws:jobref>"
+    ).encode()
+
+
+def test_top_k() -> None:
+    """Only the newest jobs are kept, in newest-first order, however the
+    document is chunked.
+    """
+    body = HEADER
+    for i in range(1000):
+        # Creation times are deliberately out of order.
+        body += _jobref(f"job{i:04d}", f"2026-01-01T00:{(i * 7) % 1000:04d}")
+    body += b"</uws:jobs>"
+
+    parser = JobListParser(limit=3)
+    for pos in range(0, len(body), 37):
+        parser.feed(body[pos : pos + 37])
+        assert len(parser.jobrefs()) <= 3
+    jobrefs = parser.close()
+
+    assert [j["@id"] for j in jobrefs] == ["job0857", "job0714", "job0571"]
+    assert jobrefs[0] == {
+        "@id": "job0857",
+        "@xlink:href": "https://x/async/job0857",
+        "uws:phase": "COMPLETED",
+        "uws:creationTime": "2026-01-01T00:0999",
+    }
+
+
+def test_unlimited_and_ties() -> None:
+    """With no limit all jobs are returned, and jobs with the same creation
+    time keep their document order.
+    """
+    parser = JobListParser()
+    parser.feed(
+        HEADER
+        + _jobref("a", "2026-01-01")
+        + _jobref("b", "2026-03-01")
+        + _jobref("c", "2026-03-01")
+        + _jobref("d", "2026-02-01")
+        + b"</uws:jobs>"
+    )
+    assert [j["@id"] for j in parser.close()] == ["b", "c", "d", "a"]
+
+
+def test_empty_and_malformed() -> None:
+    """An empty job list yields no jobs; a malformed one raises."""
+    parser = JobListParser(limit=5)
+    parser.feed(HEADER + b"</uws:jobs>")
+    assert parser.close() == []
+
+    parser = JobListParser(limit=5)
+    parser.feed(HEADER + _jobref("a", "2026-01-01"))
+    with pytest.raises(ParseError):
+        parser.feed(b"</uws:nope>")
+
+
+def test_merge_jobrefs() -> None:
+    """Merged lists are newest first, without duplicates, and trimmed."""
+    old = [
+        {"@id": "b", "uws:phase": "EXECUTING", "uws:creationTime": "2"},
+        {"@id": "a", "uws:creationTime": "1"},
+    ]
+    new = [
+        {"@id": "c", "uws:creationTime": "3"},
+        {"@id": "b", "uws:phase": "COMPLETED", "uws:creationTime": "2"},
+    ]
+    merged = merge_jobrefs(new, old)
+    assert [j["@id"] for j in merged] == ["c", "b", "a"]
+    assert merged[1]["uws:phase"] == "COMPLETED"
+    assert merge_jobrefs(new, old, limit=2) == new
@@ -37,6 +37,11 @@ export namespace CommandIDs {
   export const tapqueryrefresh = 'tapqueryrefresh';
 }
 
+/**
+ * How many recent queries to show for each dataset.
+ */
+const HISTORY_COUNT = 5;
+
 /**
  * Interface used by the extension
  */
@@ -47,14 +52,22 @@ interface IPathContainer {
 interface IRecentTAPQueryResponse {
   jobref: string;
   text: string;
+  phase?: string | null;
+  creation_time?: string | null;
+  start_time?: string | null;
+  end_time?: string | null;
+  execution_duration?: number | null;
+  row_count?: number | null;
 }
 
 class RecentTAPQueryResponse implements IRecentTAPQueryResponse {
   jobref: string;
   text: string;
+  creation_time: string | null;
 
   constructor(inp: IRecentTAPQueryResponse) {
     (this.jobref = inp.jobref), (this.text = inp.text);
+    this.creation_time = inp.creation_time ?? null;
   }
 }
 
@@ -68,7 +81,7 @@ class TAPQueryHistoryResponse implements ITAPQueryHistoryResponse {
   constructor(inp: ITAPQueryHistoryResponse) {
     for (const dsname in inp) {
       if (inp[dsname] !== null && inp[dsname].length !== 0) {
-        const responses: IRecentTAPQueryResponse[] = [];
+        const responses: RecentTAPQueryResponse[] = [];
         for (const resp of inp[dsname]) {
           responses.push(new RecentTAPQueryResponse(resp));
         }
@@ -77,6 +90,39 @@ class TAPQueryHistoryResponse implements ITAPQueryHistoryResponse {
     }
   }
 }
+
+interface IDatasetStatus {
+  status: 'ok' | 'failed' | 'unavailable';
+  detail: string | null;
+}
+
+/**
+ * Query history as returned by the server, with how the request for each
+ * dataset went.  Datasets whose TAP service failed have a status but no
+ * history.
+ */
+interface IQueryHistoryResponse {
+  history: ITAPQueryHistoryResponse;
+  status: { [dataset: string]: IDatasetStatus };
+  stale: boolean;
+}
+
+/**
+ * A new TAP job, or a change to a known one, pushed by the server.
+ */
+interface ITAPQueryHistoryEvent {
+  dataset: string;
+  jobref: string;
+  phase: string | null;
+  creation_time: string | null;
+  text: string | null;
+}
+
+/**
+ * The query history the Jobs menu was last built from.
+ */
+let currentHistory: TAPQueryHistoryResponse | undefined;
+
 /**
  * Activate the extension.
  */
@@ -97,16 +143,108 @@ export async function activateRSPTAPQueryExtension(
   jobsmenu.title.label = 'Jobs';
 
   await replaceJobsmenuContents(app, docManager, svcManager, cfg, jobsmenu);
+  subscribeTAPQueryEvents(app, docManager, svcManager, cfg, jobsmenu);
 
   logMessage(LogLevels.INFO, cfg, 'rsp-tapquery...loaded');
 }
 
-async function replaceJobsmenuContents(
+/**
+ * Keep the Jobs menu current from the server's query history events,
+ * without re-fetching the whole history.
+ */
+function subscribeTAPQueryEvents(
   app: JupyterFrontEnd,
   docManager: IDocumentManager,
   svcManager: ServiceManager.IManager,
   cfg: INubladoConfigResponse,
   jobsmenu: Menu
+): void {
+  let endpoint = PageConfig.getBaseUrl() + 'rubin/queries/tap/events';
+  const token = svcManager.serverSettings.token;
+  if (token) {
+    endpoint += `?token=${encodeURIComponent(token)}`;
+  }
+  // EventSource reconnects by itself if the connection drops.
+  const source = new EventSource(endpoint);
+  let pending: ReturnType<typeof setTimeout> | undefined;
+  source.onmessage = (msg: MessageEvent) => {
+    const event = JSON.parse(msg.data) as ITAPQueryHistoryEvent;
+    logMessage(
+      LogLevels.DEBUG,
+      cfg,
+      `TAP query event: ${event.jobref} ${event.phase}`
+    );
+    if (!currentHistory || !applyTAPQueryEvent(currentHistory, event)) {
+      return;
+    }
+    // Events tend to arrive in bursts; rebuild the menu once per burst.
+    if (pending === undefined) {
+      pending = setTimeout(() => {
+        pending = undefined;
+        replaceJobsmenuContents(
+          app,
+          docManager,
+          svcManager,
+          cfg,
+          jobsmenu,
+          currentHistory
+        ).catch(error => {
+          logMessage(LogLevels.WARNING, cfg, `Menu update failed: ${error}`);
+        });
+      }, 500);
+    }
+  };
+}
+
+/**
+ * Fold a history event into the query history.  Returns whether the
+ * menu needs to change.
+ */
+function applyTAPQueryEvent(
+  qhist: TAPQueryHistoryResponse,
+  event: ITAPQueryHistoryEvent
+): boolean {
+  // The menu only lists queries whose text we know.
+  if (!event.text) {
+    return false;
+  }
+  const entries = qhist[event.dataset] ?? [];
+  const existing = entries.find(e => e.jobref === event.jobref);
+  if (existing) {
+    if (existing.text === event.text) {
+      return false;
+    }
+    existing.text = event.text;
+  } else {
+    // Keep the list newest first.  Events for a dataset arrive newest
+    // first too, so a job is not necessarily newer than the ones we have.
+    // Creation times are ISO 8601, so they sort as strings; jobs without
+    // one go last.
+    const created = event.creation_time ?? '';
+    const entry = new RecentTAPQueryResponse({
+      jobref: event.jobref,
+      text: event.text,
+      creation_time: event.creation_time
+    });
+    const pos = entries.findIndex(e => (e.creation_time ?? '') < created);
+    if (pos === -1) {
+      entries.push(entry);
+    } else {
+      entries.splice(pos, 0, entry);
+    }
+    entries.splice(HISTORY_COUNT);
+  }
+  qhist[event.dataset] = entries;
+  return true;
+}
+
+async function replaceJobsmenuContents(
+  app: JupyterFrontEnd,
+  docManager: IDocumentManager,
+  svcManager: ServiceManager.IManager,
+  cfg: INubladoConfigResponse,
+  jobsmenu: Menu,
+  qhist?: TAPQueryHistoryResponse
 ): Promise<void> {
   const { commands } = app;
 
@@ -168,7 +306,8 @@ async function replaceJobsmenuContents(
       docManager,
       svcManager,
       cfg,
-      jobsmenu
+      jobsmenu,
+      qhist
     );
     logMessage(LogLevels.DEBUG, cfg, 'recent TAP query menu retrieved');
     logMessage(LogLevels.DEBUG, cfg, 'inserting recent TAQ query menu...');
@@ -245,7 +384,7 @@ async function tapQueryRecentHistory(
   svcManager: ServiceManager.IManager,
   cfg: INubladoConfigResponse
 ): Promise<TAPQueryHistoryResponse> {
-  const count = 5;
+  const count = HISTORY_COUNT;
   const endpoint =
     PageConfig.getBaseUrl() + `rubin/queries/tap/history/${count}`;
   const init = {
@@ -256,13 +395,27 @@ async function tapQueryRecentHistory(
   let retval = new TAPQueryHistoryResponse({});
   try {
     const res = await apiRequest(endpoint, init, settings);
-    const qh_c = res as unknown as ITAPQueryHistoryResponse;
+    const qh_r = res as unknown as IQueryHistoryResponse;
     logMessage(
       LogLevels.DEBUG,
       cfg,
-      `Got query history response: ${JSON.stringify(qh_c, undefined, 2)}`
+      `Got query history response: ${JSON.stringify(qh_r, undefined, 2)}`
     );
-    retval = new TAPQueryHistoryResponse(qh_c);
+    for (const dataset in qh_r.status) {
+      const st = qh_r.status[dataset];
+      if (st.status !== 'ok') {
+        logMessage(
+          LogLevels.WARNING,
+          cfg,
+          `No TAP query history for ${dataset}: ${st.status} ${st.detail}`
+        );
+      }
+    }
+    if (qh_r.stale) {
+      // The server keeps refreshing and pushes what it finds.
+      logMessage(LogLevels.INFO, cfg, 'TAP query history is stale');
+    }
+    retval = new TAPQueryHistoryResponse(qh_r.history);
     logMessage(
       LogLevels.DEBUG,
       cfg,
@@ -280,7 +433,8 @@ async function getRecentTAPQueryMenu(
   docManager: IDocumentManager,
   svcManager: ServiceManager.IManager,
   cfg: INubladoConfigResponse,
-  jobsmenu: Menu
+  jobsmenu: Menu,
+  history?: TAPQueryHistoryResponse
 ): Promise<Menu> {
   logMessage(LogLevels.INFO, cfg, 'Retrieving recent TAP query menu');
   const { commands } = app;
@@ -288,7 +442,8 @@ async function getRecentTAPQueryMenu(
   retval.title.label = 'Recent Queries';
 
   try {
-    const qhist = await tapQueryRecentHistory(svcManager, cfg);
+    const qhist = history ?? (await tapQueryRecentHistory(svcManager, cfg));
+    currentHistory = qhist;
     logMessage(
       LogLevels.DEBUG,
       cfg,
@@ -383,7 +538,8 @@ async function tapQueryAllHistory(
   cfg: INubladoConfigResponse
 ): Promise<void> {
   const endpoint =
-    PageConfig.getBaseUrl() + 'rubin/queries/tap/notebooks/query_all';
+    PageConfig.getBaseUrl() +
+    'rubin/queries/tap/notebooks/query_all?body=none';
   const init = {
     method: 'GET'
   };
@@ -447,7 +603,8 @@ async function openTAPQueryFromJobref(
     type: 'tap',
     value: jobref
   });
-  const endpoint = PageConfig.getBaseUrl() + 'rubin/queries';
+  // We only need the path to open; don't have the notebook echoed back.
+  const endpoint = PageConfig.getBaseUrl() + 'rubin/queries?body=none';
   const init = {
     method: 'POST',
     body: body